@@ -1,9 +1,19 @@
-from flask import Flask, send_from_directory, request, jsonify
+from flask import Flask, send_from_directory, request, jsonify, Response, stream_with_context, session, g, url_for
+from itsdangerous import URLSafeSerializer, BadSignature
 import os
 import sys
-import uuid # For unique filenames
+import uuid
 import logging # For better logging
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
+from flask.json.provider import DefaultJSONProvider
+
+# orjson serializes several times faster than the stdlib json module; optional
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Configure basic logging for the app
 logging.basicConfig(level=logging.INFO)
@@ -15,28 +25,30 @@ if parent_dir not in sys.path:
 
 # Now import from stt_tts_modules package
 try:
-    from stt_tts_modules.speech_to_text_whispr import load_stt_model, transcribe_audio_file
+    from stt_tts_modules.speech_to_text_whispr import load_stt_model, transcribe_audio_bytes
 except ImportError as e:
     logging.error(f"Error importing from speech_to_text_whispr: {e}", exc_info=True)
     # Define dummy functions if import fails, so app can still start and report errors via API
     def load_stt_model():
         raise ImportError("Failed to import STT module components. Check logs for details.")
-    def transcribe_audio_file(filepath):
+    def transcribe_audio_bytes(audio_bytes):
         return {"error": "STT module not loaded due to import error. Check server logs."}
 
 # Import Gemini client functions
 try:
-    from stt_tts_modules.gemini_client import configure_gemini, get_gemini_response
+    from stt_tts_modules.gemini_client import configure_gemini, get_gemini_response, stream_gemini_sentences
 except ImportError as e:
     logging.error(f"Error importing from gemini_client: {e}", exc_info=True)
     def configure_gemini():
         raise ImportError("Failed to import Gemini module components.")
-    def get_gemini_response(text_prompt, conversation_history=None):
+    def get_gemini_response(text_prompt, conversation_history=None, session_id=None):
         return "Error: Gemini module not loaded due to import error."
+    def stream_gemini_sentences(text_prompt, conversation_history=None, session_id=None):
+        yield "Error: Gemini module not loaded due to import error."
 
 # Import Resemble TTS client functions
 try:
-    from stt_tts_modules.resemble_tts_client import configure_resemble_tts, synthesize_speech_resemble
+    from stt_tts_modules.resemble_tts_client import configure_resemble_tts, synthesize_speech_resemble_async, stream_speech_resemble
 except ImportError as e:
     # Use app.logger if app is defined, otherwise global logging
     # Assuming app logger might not be available at this global level before app init
@@ -44,33 +56,53 @@ except ImportError as e:
     # Define dummy functions if import fails
     def configure_resemble_tts():
         raise ImportError("Failed to import Resemble TTS module.")
-    def synthesize_speech_resemble(text_to_speak):
+    def synthesize_speech_resemble_async(text_to_speak):
+        raise ImportError("Failed to import Resemble TTS module.")
+    def stream_speech_resemble(text_to_speak):
         return {"error": "Resemble TTS module not loaded due to import error."}
 
 
 app = Flask(__name__, static_folder='../frontend/static')
-
-# Define the temporary directory for audio files within the backend directory
-TEMP_AUDIO_DIR = os.path.join(os.path.dirname(__file__), "temp_audio")
-
-# Global flag to track initialization
-_app_initialized = False
+# Signs the session cookie that identifies a conversation. Without FLASK_SECRET_KEY a random
+# per-process key is used, so conversations don't survive restarts or span multiple workers.
+app.secret_key = os.getenv("FLASK_SECRET_KEY") or os.urandom(24)
+# Signs the X-Session-ID tokens handed to clients that don't keep cookies
+session_id_signer = URLSafeSerializer(app.secret_key, salt="session-id")
+
+if orjson is not None:
+    class OrjsonProvider(DefaultJSONProvider):
+        """JSON provider backed by orjson, used by jsonify() and request.get_json()."""
+        def _dump_bytes(self, obj, default=None, sort_keys=None, indent=None):
+            option = orjson.OPT_NON_STR_KEYS # int/float/bool/None dict keys, as the json module allows
+            if self.sort_keys if sort_keys is None else sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            if indent:
+                option |= orjson.OPT_INDENT_2 # orjson only indents by two spaces
+            # self.default handles dates, UUIDs, dataclasses, Decimal and __html__ like the default provider
+            return orjson.dumps(obj, default=default or self.default, option=option)
+
+        def dumps(self, obj, **kwargs):
+            return self._dump_bytes(obj, kwargs.get("default"), kwargs.get("sort_keys"), kwargs.get("indent")).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+        def response(self, *args, **kwargs):
+            # Same arguments as jsonify(): one positional value, several (sent as a list), or keywords
+            if args and kwargs:
+                raise TypeError("app.json.response() takes either args or kwargs, not both")
+            obj = (args[0] if len(args) == 1 else list(args)) if args else (kwargs or None)
+            indent = (self.compact is None and self._app.debug) or self.compact is False
+            # Write orjson's bytes straight into the response, skipping a str round trip
+            return self._app.response_class(self._dump_bytes(obj, indent=indent) + b"\n", mimetype=self.mimetype)
+
+    app.json = OrjsonProvider(app)
 
 def initialize_app():
-    """Initialize the application components"""
-    global _app_initialized
-    
-    if _app_initialized:
-        return
-    
-    # Create the temporary audio directory if it doesn't exist
-    # exist_ok=True prevents an error if the directory already exists
-    os.makedirs(TEMP_AUDIO_DIR, exist_ok=True)
-    app.logger.info(f"Temporary audio directory is: {TEMP_AUDIO_DIR}")
-
+    """Initialize the application components. Runs once per worker process at import time."""
     # Pre-load STT model
     try:
-        app.logger.info("Attempting to pre-load STT model (openai/whisper-base.en)...")
+        app.logger.info("Attempting to pre-load STT model...")
         load_stt_model()
         app.logger.info("STT model pre-loading process initiated.")
     except Exception as e:
@@ -97,12 +129,13 @@ def initialize_app():
         app.logger.error(f"Resemble TTS configuration failed: {ve}", exc_info=True)
     except Exception as e:
         app.logger.error(f"Failed to configure Resemble TTS client: {e}", exc_info=True)
-    
-    _app_initialized = True
 
-@app.before_request
-def ensure_initialized():
-    """Ensure app is initialized before handling any request"""
+# Initialize once when the worker imports the app instead of checking on every request.
+# Under Gunicorn, run without --preload: CUDA state created in the master can't be used after fork.
+# With `python backend/app.py` the debug reloader's parent process only watches files and restarts
+# the child that serves requests (WERKZEUG_RUN_MAIN=true); loading the models there too would hold
+# a second copy of Whisper and a CUDA context doing nothing.
+if __name__ != '__main__' or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
     initialize_app()
 
 @app.route('/')
@@ -113,8 +146,19 @@ def index():
 def hello():
     return "Hello from Backend!"
 
+def _transcription_error_response(result):
+    if "STT model is not loaded" in result["error"]:
+        return jsonify(result), 503 # Service Unavailable: Model not ready
+    return jsonify(result), 500 # Internal Server Error for other transcription errors
+
 @app.route('/transcribe', methods=['POST'])
 def transcribe_endpoint():
+    """Transcribes the uploaded 'audio_data' file.
+
+    For the lowest latency, upload 16 kHz mono audio at a low bitrate (e.g. Opus at 16 kbps,
+    as the web frontend records): Whisper works at 16 kHz, so such input needs no resampling
+    and the upload is several times smaller than 44.1 kHz stereo.
+    """
     if 'audio_data' not in request.files:
         app.logger.warning("Transcription request failed: No 'audio_data' file part in the request.")
         return jsonify({"error": "No audio file part"}), 400
@@ -125,63 +169,86 @@ def transcribe_endpoint():
         return jsonify({"error": "No selected file"}), 400
 
     if file:
-        # Sanitize filename and create a unique name to prevent issues
         original_filename = file.filename
-        _, extension = os.path.splitext(original_filename)
-        if not extension:
-            app.logger.warning(f"Uploaded file '{original_filename}' has no extension. Defaulting to '.wav'.")
-            extension = ".wav" # Whisper pipeline often expects a common audio extension
-
-        unique_filename = str(uuid.uuid4()) + extension
-        temp_filepath = os.path.join(TEMP_AUDIO_DIR, unique_filename)
-
         try:
-            file.save(temp_filepath)
-            app.logger.info(f"Audio file '{original_filename}' saved temporarily as {temp_filepath}")
+            # Keep the upload in memory; short voice-agent utterances never need to touch the disk
+            audio_bytes = file.read()
+            app.logger.info("Audio file '%s' received (%d bytes).", original_filename, len(audio_bytes))
 
             # Perform transcription using the STT module
-            result = transcribe_audio_file(temp_filepath)
+            result = transcribe_audio_bytes(audio_bytes)
 
             if "error" in result:
-                app.logger.error(f"Transcription failed for {temp_filepath} (original: {original_filename}): {result['error']}")
-                if "STT model is not loaded" in result["error"]:
-                    return jsonify(result), 503 # Service Unavailable: Model not ready
-                return jsonify(result), 500 # Internal Server Error for other transcription errors
+                app.logger.error(f"Transcription failed for {original_filename}: {result['error']}")
+                return _transcription_error_response(result)
 
-            app.logger.info(f"Transcription successful for {temp_filepath} (original: {original_filename}).")
+            app.logger.info("Transcription successful for %s.", original_filename)
             return jsonify(result), 200 # OK
 
         except Exception as e:
             app.logger.error(f"Unhandled exception during file processing or transcription for {original_filename}: {e}", exc_info=True)
             return jsonify({"error": "Server error during transcription process"}), 500
-        finally:
-            # Clean up the temporary file in all cases (success or failure)
-            if os.path.exists(temp_filepath):
-                try:
-                    os.remove(temp_filepath)
-                    app.logger.info(f"Temporary file {temp_filepath} removed.")
-                except OSError as e:
-                    app.logger.error(f"Error removing temporary file {temp_filepath}: {e}", exc_info=True)
 
     # This part should ideally not be reached if file checks are done correctly
     app.logger.error("File processing failed unexpectedly before transcription could start or after an unhandled issue.")
     return jsonify({"error": "File processing failed due to an unexpected issue"}), 500
 
+def _get_session_id():
+    """Identifies the conversation: a signed X-Session-ID header token, else the signed session cookie."""
+    session_token = request.headers.get('X-Session-ID')
+    if session_token:
+        try:
+            g.session_id = session_id_signer.loads(session_token)
+            return g.session_id
+        except BadSignature:
+            app.logger.warning("Ignoring X-Session-ID header with an invalid signature.")
+    if 'session_id' not in session:
+        session['session_id'] = uuid.uuid4().hex
+    g.session_id = session['session_id']
+    return g.session_id
+
+@app.after_request
+def _add_session_token(response):
+    # Clients without cookies send this token back as X-Session-ID to continue the conversation
+    if 'session_id' in g:
+        response.headers['X-Session-ID'] = session_id_signer.dumps(g.session_id)
+    return response
+
+def _normalize_history(history):
+    """Validates client-supplied history as canonical [{'role': 'user'/'model', 'parts': [...]}] entries.
+
+    Plain-string parts are wrapped as {'text': ...}. Returns None if any entry is malformed
+    (including the legacy {'sender', 'text'} format).
+    """
+    if not isinstance(history, list):
+        return None
+    normalized = []
+    for entry in history:
+        if not isinstance(entry, dict) or entry.get('role') not in ('user', 'model') or not isinstance(entry.get('parts'), list):
+            return None
+        parts = [{'text': part} if isinstance(part, str) else part for part in entry['parts']]
+        normalized.append({'role': entry['role'], 'parts': parts})
+    return normalized
+
 @app.route('/chat', methods=['POST'])
 def chat_endpoint():
-    data = request.get_json()
+    data = request.get_json(force=True, silent=True) # Parse regardless of Content-Type; None if invalid
     if not data or 'text' not in data:
         app.logger.warning("Chat request failed: Missing 'text' in JSON payload.")
         return jsonify({"error": "Missing 'text' in request body"}), 400
 
     user_text = data['text']
-    # History is optional, pass it if provided by client
-    conversation_history = data.get('history', [])
+    # History is kept server-side per session; a client may optionally seed a new session with it
+    conversation_history = _normalize_history(data.get('history', []))
+    if conversation_history is None:
+        app.logger.warning("Chat request failed: 'history' is not in canonical {role, parts} format.")
+        return jsonify({"error": "'history' must be a list of {role: 'user'|'model', parts: [...]} entries"}), 400
+    session_id = _get_session_id()
 
-    app.logger.info(f"Received chat request: '{user_text}', history length: {len(conversation_history)}")
+    app.logger.info("Received chat request: '%s', session: %s", user_text, session_id)
 
     try:
-        bot_response = get_gemini_response(user_text, conversation_history)
+        bot_response = get_gemini_response(user_text, conversation_history, session_id=session_id)
 
         if bot_response.startswith("Error:"):
             app.logger.error(f"Gemini response error: {bot_response}")
@@ -190,7 +257,7 @@ def chat_endpoint():
                  return jsonify({"error": bot_response}), 503 # Service Unavailable (config issue)
             return jsonify({"error": bot_response}), 500 # Internal Server Error
 
-        app.logger.info(f"Gemini bot response: '{bot_response}'")
+        app.logger.info("Gemini bot response: '%s'", bot_response)
         return jsonify({"response": bot_response}), 200
     except Exception as e:
         app.logger.error(f"Exception in /chat endpoint: {e}", exc_info=True)
@@ -198,37 +265,136 @@ def chat_endpoint():
 
 @app.route('/synthesize', methods=['POST'])
 def synthesize_endpoint():
-    data = request.get_json()
+    data = request.get_json(force=True, silent=True) # Parse regardless of Content-Type; None if invalid
     if not data or 'text' not in data:
         app.logger.warning("/synthesize request failed: Missing 'text' in JSON payload.")
         return jsonify({"error": "Missing 'text' in request body"}), 400
 
     text_to_synthesize = data['text']
-    app.logger.info(f"Received /synthesize request for text: '{text_to_synthesize[:50]}...'")
-
+    app.logger.info("Received /synthesize request for text: '%.50s...'", text_to_synthesize)
+    return _synthesis_response(text_to_synthesize)
+
+@app.route('/clip', methods=['GET'])
+def clip_endpoint():
+    """Streams the audio for one reply sentence; the audio_url of /chat_speech and /voice_turn frames."""
+    text_to_synthesize = request.args.get('text')
+    if not text_to_synthesize:
+        app.logger.warning("/clip request failed: Missing 'text' query parameter.")
+        return jsonify({"error": "Missing 'text' query parameter"}), 400
+    return _synthesis_response(text_to_synthesize)
+
+def _synthesis_response(text_to_synthesize):
     try:
-        synthesis_result = synthesize_speech_resemble(text_to_synthesize)
+        # Audio bytes are forwarded as they arrive (streamed synthesis or a downloaded clip),
+        # so playback can start before the whole utterance is available
+        synthesis_result = stream_speech_resemble(text_to_synthesize)
 
         if "error" in synthesis_result:
             app.logger.error(f"Resemble TTS synthesis error: {synthesis_result['error']}")
             if "configuration error" in synthesis_result['error'] or "not set" in synthesis_result['error']:
                  return jsonify(synthesis_result), 503 # Service Unavailable (config issue)
+            if synthesis_result['error'].startswith("Failed to fetch synthesized audio"):
+                return jsonify(synthesis_result), 502 # Bad Gateway: upstream audio fetch failed
             return jsonify(synthesis_result), 500 # Internal Server Error for other synthesis errors
 
-        if "audio_url" in synthesis_result:
-            app.logger.info(f"Resemble TTS synthesis successful. Audio URL: {synthesis_result['audio_url']}")
-            return jsonify({"audio_url": synthesis_result['audio_url']}), 200
-        else:
-            app.logger.error(f"Resemble TTS did not return an audio URL or known error. Result: {synthesis_result}")
-            return jsonify({"error": "TTS synthesis failed to return audio URL."}), 500
+        app.logger.info("Resemble TTS synthesis started streaming (%s).", synthesis_result['mimetype'])
+        return Response(stream_with_context(synthesis_result['stream']), mimetype=synthesis_result['mimetype'])
 
     except Exception as e:
-        app.logger.error(f"Exception in /synthesize endpoint: {e}", exc_info=True)
+        app.logger.error(f"Exception during speech synthesis: {e}", exc_info=True)
         return jsonify({"error": "Server error during speech synthesis"}), 500
 
+def _ndjson_frame(frame):
+    return app.json.dumps(frame) + "\n"
+
+TTS_SENTENCE_TIMEOUT_S = 30 # Longest wait for one sentence's clip before reporting it as failed
+
+def _speech_frame(sentence, tts_future):
+    try:
+        synthesis_result = tts_future.result(timeout=TTS_SENTENCE_TIMEOUT_S)
+    except FutureTimeoutError:
+        app.logger.error(f"Resemble TTS synthesis timed out for sentence '{sentence[:50]}'")
+        return _ndjson_frame({"text": sentence, "error": "TTS synthesis timed out."})
+    if "audio_url" in synthesis_result:
+        # A same-origin URL rather than the Resemble link: the server fetches the clip over its pooled
+        # connections and re-synthesizes it if the cached link has expired
+        return _ndjson_frame({"text": sentence, "audio_url": url_for('clip_endpoint', text=sentence)})
+    app.logger.error(f"Resemble TTS synthesis error for sentence '{sentence[:50]}': {synthesis_result.get('error')}")
+    return _ndjson_frame({"text": sentence, "error": synthesis_result.get("error", "TTS synthesis failed.")})
+
+def _iter_spoken_reply(user_text, session_id):
+    """Yields NDJSON frames {"text", "audio_url"} per sentence of the Gemini reply, in order.
+
+    Each sentence is sent to TTS as soon as Gemini finishes it, so clip generation overlaps
+    with the rest of the reply still being generated.
+    """
+    pending = deque() # (sentence, Future) in reply order
+    try:
+        for sentence in stream_gemini_sentences(user_text, session_id=session_id):
+            if sentence.startswith("Error:"):
+                app.logger.error(f"Gemini response error: {sentence}")
+                yield _ndjson_frame({"error": sentence})
+                break
+            pending.append((sentence, synthesize_speech_resemble_async(sentence)))
+            # Flush sentences whose audio is already ready without waiting on the LLM
+            while pending and pending[0][1].done():
+                yield _speech_frame(*pending.popleft())
+        while pending:
+            yield _speech_frame(*pending.popleft())
+    finally:
+        # The client disconnected: don't spend TTS workers (and billed clips) on sentences nobody hears
+        for _, tts_future in pending:
+            tts_future.cancel()
+
+@app.route('/chat_speech', methods=['POST'])
+def chat_speech_endpoint():
+    """Chat turn with speech: streams newline-delimited JSON frames, one per reply sentence."""
+    data = request.get_json(force=True, silent=True) # Parse regardless of Content-Type; None if invalid
+    if not data or 'text' not in data:
+        app.logger.warning("/chat_speech request failed: Missing 'text' in JSON payload.")
+        return jsonify({"error": "Missing 'text' in request body"}), 400
+
+    session_id = _get_session_id()
+    app.logger.info("Received /chat_speech request: '%s', session: %s", data['text'], session_id)
+    return Response(stream_with_context(_iter_spoken_reply(data['text'], session_id)), mimetype='application/x-ndjson')
+
+@app.route('/voice_turn', methods=['POST'])
+def voice_turn_endpoint():
+    """A whole voice turn in one request: speech in, spoken reply out.
+
+    Takes the same 'audio_data' upload as /transcribe and streams newline-delimited JSON:
+    first {"transcript", "language"}, then the per-sentence {"text", "audio_url"} frames of
+    /chat_speech as the reply is generated and synthesized.
+    """
+    file = request.files.get('audio_data')
+    if file is None or file.filename == '':
+        app.logger.warning("/voice_turn request failed: No 'audio_data' file in the request.")
+        return jsonify({"error": "No audio file part"}), 400
+
+    try:
+        result = transcribe_audio_bytes(file.read())
+    except Exception as e:
+        app.logger.error(f"Unhandled exception during /voice_turn transcription: {e}", exc_info=True)
+        return jsonify({"error": "Server error during transcription process"}), 500
+    if "error" in result:
+        app.logger.error(f"/voice_turn transcription failed: {result['error']}")
+        return _transcription_error_response(result)
+
+    user_text = result["text"].strip()
+    if not user_text:
+        return jsonify({"error": "No speech detected in the recording"}), 400
+
+    session_id = _get_session_id()
+    app.logger.info("Received /voice_turn: '%s', session: %s", user_text, session_id)
+
+    def _iter_voice_turn():
+        yield _ndjson_frame({"transcript": user_text, "language": result.get("language")})
+        yield from _iter_spoken_reply(user_text, session_id)
+
+    return Response(stream_with_context(_iter_voice_turn()), mimetype='application/x-ndjson')
+
 if __name__ == '__main__':
     # Flask's development server.
-    # For production, a WSGI server like Gunicorn or uWSGI should be used.
-    # Model loading via initialization function is suitable for dev mode.
-    # For production, consider loading models when worker processes start.
+    # For production, use a WSGI server, e.g.: gunicorn --workers 1 --threads 8 backend.app:app
+    # Each worker initializes (and loads the models) once when it imports this module.
     app.run(debug=True, port=5000, host='0.0.0.0') # Listen on all interfaces
\ No newline at end of file
@@ -23,6 +23,38 @@ document.addEventListener('DOMContentLoaded', () => {
     let mediaRecorder;
     let audioChunks = [];
     let mediaStream = null;
+    let recordingContext = null;
+
+    // Recording settings: 16 kHz mono Opus at 16 kbps. Whisper works at 16 kHz anyway,
+    // so this shrinks uploads several-fold without hurting transcription quality.
+    const RECORDING_SAMPLE_RATE = 16000;
+    const RECORDING_BITS_PER_SECOND = 16000;
+    const RECORDING_MIME_TYPE = 'audio/webm;codecs=opus';
+
+    // Builds a MediaRecorder over a 16 kHz mono version of the microphone stream
+    function createRecorder(stream) {
+        const options = { audioBitsPerSecond: RECORDING_BITS_PER_SECOND };
+        if (MediaRecorder.isTypeSupported(RECORDING_MIME_TYPE)) options.mimeType = RECORDING_MIME_TYPE;
+        try {
+            recordingContext = new AudioContext({ sampleRate: RECORDING_SAMPLE_RATE });
+            const destination = recordingContext.createMediaStreamDestination();
+            destination.channelCount = 1;
+            recordingContext.createMediaStreamSource(stream).connect(destination);
+            return new MediaRecorder(destination.stream, options);
+        } catch (err) {
+            // Some browsers can't resample a live stream; record it at its native rate instead
+            console.warn('Could not record at 16 kHz, using the native sample rate:', err);
+            releaseRecordingContext();
+            return new MediaRecorder(stream, options);
+        }
+    }
+
+    function releaseRecordingContext() {
+        if (recordingContext) {
+            recordingContext.close();
+            recordingContext = null;
+        }
+    }
 
     // --- Chat Elements and Logic ---
     const chatInput = document.getElementById('chatInput');
@@ -31,11 +63,20 @@ document.addEventListener('DOMContentLoaded', () => {
     const chatStatus = document.getElementById('chatStatus');
     const ttsAudioPlayback = document.getElementById('ttsAudioPlayback');
 
-    let conversationHistory = [];
-    const MAX_HISTORY_LENGTH = 20;
+    // Sentence clips of a streamed voice-turn reply, played back one after another
+    let ttsQueue = [];
+    let ttsQueuePlaying = false;
+    // The voice turn whose reply is still streaming in; aborted when the user interrupts the bot
+    let voiceTurnController = null;
 
     // Helper function to stop ongoing TTS
     function stopTTSPlayback() {
+        if (voiceTurnController) {
+            voiceTurnController.abort(); // Also lets the server stop generating the old reply
+            voiceTurnController = null;
+        }
+        ttsQueue = [];
+        ttsQueuePlaying = false;
         if (ttsAudioPlayback && !ttsAudioPlayback.paused) {
             ttsAudioPlayback.pause();
             ttsAudioPlayback.src = ""; // Clear source
@@ -47,14 +88,48 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    function appendMessageToChat(sender, message, type = 'normal') {
-        const messageElement = document.createElement('p');
+    function playNextQueuedTTS() {
+        const audioUrl = ttsQueue.shift();
+        if (!audioUrl) {
+            ttsQueuePlaying = false;
+            if (chatStatus) chatStatus.textContent = 'Audio finished.';
+            return;
+        }
+        ttsQueuePlaying = true;
+        ttsAudioPlayback.src = audioUrl;
+        ttsAudioPlayback.onended = playNextQueuedTTS;
+        ttsAudioPlayback.onerror = (e) => {
+            console.error("Error playing TTS audio:", e);
+            playNextQueuedTTS();
+        };
+        ttsAudioPlayback.play()
+            .then(() => { if (chatStatus) chatStatus.textContent = 'Playing audio...'; })
+            .catch(playError => {
+                console.error("Autoplay was prevented or error during play:", playError);
+                ttsQueue = [];
+                ttsQueuePlaying = false;
+                if (chatStatus) chatStatus.textContent = 'Could not autoplay speech.';
+            });
+    }
+
+    function enqueueTTSAudio(audioUrl) {
+        if (!ttsAudioPlayback) return;
+        ttsQueue.push(audioUrl);
+        if (!ttsQueuePlaying) playNextQueuedTTS();
+    }
+
+    function renderChatMessage(messageElement, sender, message) {
         let content = `<strong>${sender}:</strong> `;
 
         const sanitizedMessage = message.replace(/</g, "&lt;").replace(/>/g, "&gt;");
         content += sanitizedMessage.replace(/\n/g, '<br>');
 
         messageElement.innerHTML = content;
+        chatOutput.scrollTop = chatOutput.scrollHeight;
+    }
+
+    function appendMessageToChat(sender, message, type = 'normal') {
+        const messageElement = document.createElement('p');
         if (type === 'error') {
             messageElement.style.color = 'red';
         } else if (type === 'system') {
@@ -62,7 +137,95 @@ document.addEventListener('DOMContentLoaded', () => {
             messageElement.style.color = 'grey';
         }
         chatOutput.appendChild(messageElement);
-        chatOutput.scrollTop = chatOutput.scrollHeight;
+        renderChatMessage(messageElement, sender, message);
+        return messageElement;
+    }
+
+    // Reads a newline-delimited JSON response, calling onFrame for each object as it arrives
+    async function readNdjsonStream(response, onFrame) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffered += decoder.decode(value, { stream: true });
+            const lines = buffered.split('\n');
+            buffered = lines.pop();
+            lines.filter(line => line.trim()).forEach(line => onFrame(JSON.parse(line)));
+        }
+        if (buffered.trim()) onFrame(JSON.parse(buffered));
+    }
+
+    // One round trip per spoken turn: uploads the recording to /voice_turn, then shows the
+    // transcript and the reply sentence by sentence, queueing each sentence's audio as it arrives.
+    async function sendVoiceTurn(audioFile) {
+        const formData = new FormData();
+        formData.append('audio_data', audioFile);
+
+        const controller = new AbortController();
+        voiceTurnController = controller;
+        try {
+            const response = await fetch('/voice_turn', { method: 'POST', body: formData, signal: controller.signal });
+            if (!response.ok) {
+                const result = await response.json().catch(() => ({}));
+                const errMsg = `Voice Turn Error: ${result.error || 'Unknown error'}`;
+                if (statusMessage) statusMessage.textContent = errMsg;
+                appendMessageToChat('System', errMsg, 'error');
+                return;
+            }
+
+            let botMessageElement = null;
+            let botResponseText = '';
+            await readNdjsonStream(response, frame => {
+                if (controller.signal.aborted) return; // Interrupted: drop what is left of the old reply
+                if (frame.transcript !== undefined) {
+                    if (statusMessage) statusMessage.textContent = "Transcription successful.";
+                    appendMessageToChat('User', frame.transcript);
+                    if (chatStatus) chatStatus.textContent = 'Bot is thinking...';
+                } else if (frame.text) {
+                    botResponseText += (botResponseText ? ' ' : '') + frame.text;
+                    if (botMessageElement) renderChatMessage(botMessageElement, 'Bot', botResponseText);
+                    else botMessageElement = appendMessageToChat('Bot', botResponseText);
+                    if (frame.audio_url) enqueueTTSAudio(frame.audio_url);
+                    else console.warn('No audio for sentence:', frame.error);
+                } else if (frame.error) {
+                    appendMessageToChat('Bot', `Chat Error: ${frame.error}`, 'error');
+                    if (chatStatus) chatStatus.textContent = 'Failed to get chat response.';
+                }
+            });
+        } catch (error) {
+            if (error.name === 'AbortError') {
+                console.log('Voice turn interrupted by the user.');
+                return;
+            }
+            throw error;
+        } finally {
+            if (voiceTurnController === controller) voiceTurnController = null;
+        }
+    }
+
+    // Appends a streamed audio/mpeg response to a MediaSource chunk by chunk; returns its object URL
+    function streamAudioToMediaSource(response) {
+        const mediaSource = new MediaSource();
+        mediaSource.addEventListener('sourceopen', async () => {
+            const sourceBuffer = mediaSource.addSourceBuffer('audio/mpeg');
+            const waitForUpdate = () => new Promise(resolve => sourceBuffer.addEventListener('updateend', resolve, { once: true }));
+            const reader = response.body.getReader();
+            try {
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    sourceBuffer.appendBuffer(value);
+                    await waitForUpdate();
+                }
+                if (mediaSource.readyState === 'open') mediaSource.endOfStream();
+            } catch (error) {
+                console.error('Error streaming TTS audio:', error);
+                if (mediaSource.readyState === 'open') mediaSource.endOfStream('network');
+            }
+        }, { once: true });
+        return URL.createObjectURL(mediaSource);
     }
 
     async function playTextAsSpeech(text) {
@@ -87,11 +250,15 @@ document.addEventListener('DOMContentLoaded', () => {
                 body: JSON.stringify({ text: text })
             });
 
-            const result = await response.json();
+            const contentType = response.headers.get('Content-Type') || '';
 
-            if (response.ok && result.audio_url) {
+            if (response.ok && contentType.startsWith('audio/')) {
+                // The backend streams the synthesized audio directly. MP3 is fed to a MediaSource so
+                // playback starts with the first chunks; other formats are played once fully downloaded.
+                const canStream = contentType.startsWith('audio/mpeg') && window.MediaSource && MediaSource.isTypeSupported('audio/mpeg');
+                const audioUrl = canStream ? streamAudioToMediaSource(response) : URL.createObjectURL(await response.blob());
                 if (chatStatus) chatStatus.textContent = 'Speech synthesized. Playing...';
-                ttsAudioPlayback.src = result.audio_url;
+                ttsAudioPlayback.src = audioUrl;
 
                 try {
                     await ttsAudioPlayback.play();
@@ -99,19 +266,22 @@ document.addEventListener('DOMContentLoaded', () => {
 
                     ttsAudioPlayback.onended = () => {
                         if (chatStatus) chatStatus.textContent = 'Audio finished.';
+                        URL.revokeObjectURL(audioUrl);
                     };
                     ttsAudioPlayback.onerror = (e) => {
                         console.error("Error playing TTS audio:", e);
                         if (chatStatus) chatStatus.textContent = 'Error playing audio.';
                         appendMessageToChat('System', 'Could not play TTS audio. Playback error.', 'error');
+                        URL.revokeObjectURL(audioUrl);
                     };
 
                 } catch (playError) {
                     console.error("Autoplay was prevented or error during play:", playError);
                     if (chatStatus) chatStatus.textContent = 'Could not autoplay speech.';
-                    appendMessageToChat('System', `Speech synthesized. <a href="${result.audio_url}" target="_blank" rel="noopener noreferrer">Play audio</a> (Autoplay blocked or failed)`, 'system');
+                    appendMessageToChat('System', `Speech synthesized. <a href="${audioUrl}" target="_blank" rel="noopener noreferrer">Play audio</a> (Autoplay blocked or failed)`, 'system');
                 }
             } else {
+                const result = await response.json().catch(() => ({}));
                 const errorMessage = `TTS Synthesis Error: ${result.error || 'Unknown TTS error'}`;
                 console.error(errorMessage);
                 if (chatStatus) chatStatus.textContent = 'Failed to synthesize speech.';
@@ -129,11 +299,6 @@ document.addEventListener('DOMContentLoaded', () => {
         if (!text.trim()) return;
 
         appendMessageToChat('User', text);
-        conversationHistory.push({ role: 'user', parts: [{ text: text }] });
-
-        if (conversationHistory.length > MAX_HISTORY_LENGTH) {
-            conversationHistory = conversationHistory.slice(conversationHistory.length - MAX_HISTORY_LENGTH);
-        }
 
         if (chatStatus) chatStatus.textContent = 'Bot is thinking...';
         if(chatInput) chatInput.value = '';
@@ -142,7 +307,8 @@ document.addEventListener('DOMContentLoaded', () => {
             const response = await fetch('/chat', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ text: text, history: conversationHistory })
+                // Conversation history is kept by the server, keyed by the session cookie
+                body: JSON.stringify({ text: text })
             });
 
             const result = await response.json();
@@ -150,7 +316,6 @@ document.addEventListener('DOMContentLoaded', () => {
             if (response.ok && result.response) {
                 const botResponseText = result.response;
                 appendMessageToChat('Bot', botResponseText);
-                conversationHistory.push({ role: 'model', parts: [{ text: botResponseText }] });
 
                 await playTextAsSpeech(botResponseText);
 
@@ -196,8 +361,8 @@ document.addEventListener('DOMContentLoaded', () => {
             if (statusMessage) statusMessage.textContent = "Requesting microphone permission...";
             audioChunks = [];
             try {
-                mediaStream = await navigator.mediaDevices.getUserMedia({ audio: true });
-                mediaRecorder = new MediaRecorder(mediaStream);
+                mediaStream = await navigator.mediaDevices.getUserMedia({ audio: { channelCount: 1 } });
+                mediaRecorder = createRecorder(mediaStream);
 
                 mediaRecorder.ondataavailable = event => {
                     audioChunks.push(event.data);
@@ -213,6 +378,7 @@ document.addEventListener('DOMContentLoaded', () => {
                             mediaStream.getTracks().forEach(track => track.stop());
                             mediaStream = null;
                         }
+                        releaseRecordingContext();
                         return;
                     }
 
@@ -229,29 +395,8 @@ document.addEventListener('DOMContentLoaded', () => {
                     const audioUrl = URL.createObjectURL(audioBlob);
                     if (audioPlayback) audioPlayback.src = audioUrl;
 
-                    const formData = new FormData();
-                    formData.append('audio_data', audioFile);
-
                     try {
-                        const transcribeResponse = await fetch('/transcribe', {
-                            method: 'POST',
-                            body: formData
-                        });
-                        const transcribeResult = await transcribeResponse.json();
-
-                        if (transcribeResponse.ok && transcribeResult.text) {
-                            if (statusMessage) statusMessage.textContent = "Transcription successful. Sending to chat...";
-                            if (chatInput) {
-                                chatInput.value = transcribeResult.text;
-                                await sendChatMessage(transcribeResult.text);
-                            } else {
-                                appendMessageToChat('System (Transcribed)', transcribeResult.text, 'system');
-                            }
-                        } else {
-                            const errMsg = `Transcription Error: ${transcribeResult.error || 'Unknown error'}`;
-                            if (statusMessage) statusMessage.textContent = errMsg;
-                            appendMessageToChat('System', errMsg, 'error');
-                        }
+                        await sendVoiceTurn(audioFile);
                     } catch (transcribeError) {
                         console.error('Error during transcription request:', transcribeError);
                         const errMsg = 'Error: Could not connect for transcription.';
@@ -264,6 +409,7 @@ document.addEventListener('DOMContentLoaded', () => {
                             mediaStream.getTracks().forEach(track => track.stop());
                             mediaStream = null;
                         }
+                        releaseRecordingContext();
                         recordButton.disabled = false;
                         stopButton.disabled = true;
                     }
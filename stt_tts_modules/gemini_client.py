@@ -1,9 +1,27 @@
 import os
+import re
+import threading
+from collections import OrderedDict
 import google.generativeai as genai
 
 GENERATIVE_MODEL = None
 MODEL_INITIALIZED = False
 CONVERSATION_HISTORY_LIMIT = 10 # Max number of (user, model) turns to keep
+# History is trimmed in whole blocks rather than one turn at a time, so the prompt prefix
+# (system instruction + oldest kept turns) stays byte-identical across several requests
+# and Gemini's implicit prompt caching can reuse it.
+HISTORY_TRIM_STEP = 4
+GEMINI_MODEL_NAME = 'gemini-2.5-flash'
+
+# A live ChatSession is kept per conversation so each turn only sends the new user message;
+# the SDK accumulates history itself and the earlier turns stay an unmodified, cacheable prefix.
+MAX_SESSIONS = 1024 # Least recently used sessions are evicted beyond this
+SESSIONS: "OrderedDict[str, tuple]" = OrderedDict() # session_id -> (genai.ChatSession, threading.Lock)
+_sessions_lock = threading.Lock()
+_init_lock = threading.Lock() # Ensures genai.configure() runs once even if threads race on first use
+
+# Where a streamed reply can be cut into sentences for speech synthesis
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|(?<=[。！？])')
 
 # Default prompt to guide the chatbot's behavior
 DEFAULT_SYSTEM_PROMPT = "You are a helpful and concise multilingual conversational assistant. Respond in the language of the user's prompt if you can determine it, otherwise use English. Keep your answers brief."
@@ -14,28 +32,69 @@ def configure_gemini():
         print("Gemini model already configured.")
         return
 
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("Error: GEMINI_API_KEY environment variable not found.")
-        # MODEL_INITIALIZED remains False
-        raise ValueError("GEMINI_API_KEY environment variable not set.")
+    with _init_lock:
+        if MODEL_INITIALIZED: # Another thread finished configuring while we waited
+            return
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            print("Error: GEMINI_API_KEY environment variable not found.")
+            # MODEL_INITIALIZED remains False
+            raise ValueError("GEMINI_API_KEY environment variable not set.")
 
+        try:
+            genai.configure(api_key=api_key)
+            # Using gemini-2.5-flash as it's fast, capable for chat, and supports implicit
+            # prompt caching of a stable prefix. For more complex tasks gemini-2.5-pro could be used.
+            GENERATIVE_MODEL = genai.GenerativeModel(
+                model_name=GEMINI_MODEL_NAME,
+                system_instruction=DEFAULT_SYSTEM_PROMPT
+            )
+            MODEL_INITIALIZED = True
+            print(f"Gemini client configured successfully with model '{GEMINI_MODEL_NAME}'.")
+        except Exception as e:
+            MODEL_INITIALIZED = False
+            print(f"Error configuring Gemini client: {e}")
+            raise # Re-raise the exception
+
+def _trim_history(chat):
+    """Drops the oldest turns in blocks of HISTORY_TRIM_STEP once the chat exceeds the history limit."""
+    overflow = len(chat.history) - CONVERSATION_HISTORY_LIMIT
+    if overflow > 0:
+        chat.history = chat.history[-(-overflow // HISTORY_TRIM_STEP) * HISTORY_TRIM_STEP:] # Round up to a whole block
+
+def _get_chat_session(session_id: str, seed_history: list = None):
+    """Returns (chat, lock) for a session, starting a new chat (optionally seeded) if needed."""
+    with _sessions_lock:
+        entry = SESSIONS.get(session_id)
+        if entry is None:
+            chat = GENERATIVE_MODEL.start_chat(history=seed_history or [])
+            _trim_history(chat)
+            entry = (chat, threading.Lock()) # Serializes turns of one conversation
+            SESSIONS[session_id] = entry
+            if len(SESSIONS) > MAX_SESSIONS:
+                SESSIONS.popitem(last=False)
+        else:
+            SESSIONS.move_to_end(session_id)
+        return entry
+
+def _discard_unfinished_turn(chat, session_id):
+    """Removes a streamed turn that never completed, so the chat's history stays readable."""
     try:
-        genai.configure(api_key=api_key)
-        # Using gemini-1.5-flash as it's fast and capable for chat.
-        # For more complex tasks or if issues arise, gemini-pro could be used.
-        GENERATIVE_MODEL = genai.GenerativeModel(
-            model_name='gemini-1.5-flash',
-            system_instruction=DEFAULT_SYSTEM_PROMPT
-        )
-        MODEL_INITIALIZED = True
-        print("Gemini client configured successfully with model 'gemini-1.5-flash'.")
+        chat.rewind()
     except Exception as e:
-        MODEL_INITIALIZED = False
-        print(f"Error configuring Gemini client: {e}")
-        raise # Re-raise the exception
-
-def get_gemini_response(user_prompt: str, conversation_history: list = None):
+        # Couldn't be rewound: forget the session rather than leave it permanently broken
+        print(f"Dropping Gemini session after an unfinished stream: {e}")
+        if session_id is not None:
+            with _sessions_lock:
+                SESSIONS.pop(session_id, None)
+
+def get_gemini_response(user_prompt: str, conversation_history: list = None, session_id: str = None):
+    """Sends user_prompt to Gemini and returns the reply text, or a string starting with "Error:".
+
+    With a session_id the chat session is kept server-side (conversation_history only seeds a new
+    session); without one, a throwaway chat is started from conversation_history. History entries
+    must already be in canonical {'role', 'parts'} form.
+    """
     global GENERATIVE_MODEL, MODEL_INITIALIZED
 
     if not MODEL_INITIALIZED or GENERATIVE_MODEL is None:
@@ -52,47 +111,39 @@ def get_gemini_response(user_prompt: str, conversation_history: list = None):
             return "Error: Gemini model is not available."
 
     try:
-        # Construct the chat history for Gemini API
-        # The history format expected by Gemini is a list of Content objects (parts: text, role: user/model)
-        # For simplicity, we'll manage history as a list of dictionaries [{role: 'user'/'model', 'parts': [text_prompt]}]
-        # and pass it directly to start_chat.
-
-        current_chat_session_messages = []
-        if conversation_history:
-            for entry in conversation_history[-CONVERSATION_HISTORY_LIMIT:]: # Use last N turns
-                # Ensure role and parts structure
-                if 'role' in entry and 'parts' in entry:
-                     current_chat_session_messages.append(entry)
-                elif 'text' in entry and 'sender' in entry: # Adapt from a simpler format if needed
-                    role = 'user' if entry['sender'] == 'user' else 'model'
-                    current_chat_session_messages.append({'role': role, 'parts': [{'text': entry['text']}]})
-
-
-        # Start a new chat session or use an existing one if state management is more complex
-        # For stateless requests per /chat call, we re-start chat with history
-        chat = GENERATIVE_MODEL.start_chat(history=current_chat_session_messages)
-
-        print(f"Sending to Gemini: '{user_prompt}' with history length: {len(current_chat_session_messages)}")
-        response = chat.send_message(user_prompt)
-
-        # Extract text from response
-        # Response object can have complex structure, need to access text part
-        if response and response.parts:
-            # Join parts if there are multiple, though for text prompts usually one part.
-            bot_response_text = "".join(part.text for part in response.parts if hasattr(part, 'text'))
-            if not bot_response_text and response.candidates and response.candidates[0].content.parts:
-                 bot_response_text = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text'))
-
-            print(f"Gemini response: {bot_response_text}")
-            return bot_response_text
-        elif response and hasattr(response, 'text') and response.text: # Older API or simpler response
-            print(f"Gemini response (simple): {response.text}")
-            return response.text
+        # The history format expected by Gemini is a list of Content objects (parts: text, role: user/model),
+        # passed as dictionaries [{role: 'user'/'model', 'parts': [...]}] when seeding a chat.
+        # Entries are kept in their original order and never edited: the system instruction and
+        # earlier turns form the cacheable prefix, only the new user prompt is volatile.
+        if session_id is not None:
+            chat, chat_lock = _get_chat_session(session_id, conversation_history)
         else:
+            chat, chat_lock = GENERATIVE_MODEL.start_chat(history=conversation_history or []), threading.Lock()
+            _trim_history(chat) # Use last N turns
+
+        with chat_lock:
+            print(f"Sending to Gemini: '{user_prompt}' with history length: {len(chat.history)}")
+            response = chat.send_message(user_prompt) # The SDK appends both turns to chat.history
+            _trim_history(chat)
+
+        # response.text is the SDK's accessor for the common single-candidate text reply;
+        # it raises ValueError when there is no usable text part (e.g. a blocked response).
+        try:
+            bot_response_text = response.text
+        except (ValueError, AttributeError):
+            bot_response_text = "".join(
+                part.text for part in (response.candidates[0].content.parts if response.candidates else [])
+                if getattr(part, 'text', None)
+            )
+
+        if not bot_response_text:
             # Log the full response if text extraction fails, to help debug
             print(f"Gemini response did not contain expected text. Full response: {response}")
             return "Error: Received an empty or unexpected response from Gemini."
 
+        print(f"Gemini response: {bot_response_text}")
+        return bot_response_text
+
     except Exception as e:
         print(f"Error getting response from Gemini: {e}")
         # Check for specific API errors if possible, e.g., related to API key or quota
@@ -101,6 +152,61 @@ def get_gemini_response(user_prompt: str, conversation_history: list = None):
             return "Error: Gemini API key is invalid or missing. Please check server configuration."
         return f"Error communicating with Gemini: {error_message}"
 
+def stream_gemini_sentences(user_prompt: str, conversation_history: list = None, session_id: str = None):
+    """Streams the reply to user_prompt from Gemini, yielding it one sentence at a time.
+
+    Takes the same arguments as get_gemini_response. On failure a single string starting
+    with "Error:" is yielded and the generator stops.
+    """
+    if not MODEL_INITIALIZED or GENERATIVE_MODEL is None:
+        try:
+            print("Gemini model not initialized. Attempting to configure now...")
+            configure_gemini()
+        except ValueError as ve:
+            yield f"Error: Gemini API key not set. {str(ve)}"
+            return
+        except Exception as e:
+            yield f"Error: Gemini model could not be initialized. {str(e)}"
+            return
+
+    if session_id is not None:
+        chat, chat_lock = _get_chat_session(session_id, conversation_history)
+    else:
+        chat, chat_lock = GENERATIVE_MODEL.start_chat(history=conversation_history or []), threading.Lock()
+        _trim_history(chat)
+
+    try:
+        # Held until the stream is fully consumed: the SDK only records the turn once it completes
+        with chat_lock:
+            print(f"Streaming from Gemini: '{user_prompt}' with history length: {len(chat.history)}")
+            response = None
+            response_consumed = False
+            try:
+                response = chat.send_message(user_prompt, stream=True)
+                pending_text = ""
+                for chunk in response:
+                    pending_text += chunk.text
+                    *sentences, pending_text = SENTENCE_BOUNDARY.split(pending_text)
+                    for sentence in sentences:
+                        if sentence.strip():
+                            yield sentence.strip()
+                response_consumed = True
+                if pending_text.strip():
+                    yield pending_text.strip()
+                _trim_history(chat)
+            finally:
+                # Reached on errors mid-stream and on GeneratorExit when the client disconnects early;
+                # an unfinished response would make every later chat.history access raise.
+                if response is not None and not response_consumed:
+                    _discard_unfinished_turn(chat, session_id)
+    except Exception as e:
+        print(f"Error streaming response from Gemini: {e}")
+        error_message = str(e)
+        if "API_KEY_INVALID" in error_message or "API_KEY_MISSING" in error_message:
+            yield "Error: Gemini API key is invalid or missing. Please check server configuration."
+        else:
+            yield f"Error communicating with Gemini: {error_message}"
+
 if __name__ == "__main__":
     print("Running gemini_client.py in standalone mode.")
     try:
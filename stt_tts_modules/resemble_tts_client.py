@@ -1,4 +1,12 @@
 import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import urllib3
 from resemble import Resemble # Assuming this is the correct import for Resemble AI SDK
 import logging
 
@@ -7,61 +15,219 @@ logger = logging.getLogger(__name__)
 RESEMBLE_API_KEY_ENV = "RESEMBLE_API_KEY"
 RESEMBLE_PROJECT_UUID_ENV = "RESEMBLE_PROJECT_UUID"
 RESEMBLE_VOICE_UUID_ENV = "RESEMBLE_VOICE_UUID"
+RESEMBLE_SYN_SERVER_URL_ENV = "RESEMBLE_SYN_SERVER_URL" # Enables the streaming synthesis endpoint
+
+# Discovered project/voice UUIDs are remembered here so restarts skip the discovery API calls
+UUID_CACHE_PATH = os.getenv("RESEMBLE_UUID_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".resemble_uuids.json"))
+UUID_CACHE_MAX_AGE_SECONDS = 7 * 24 * 3600
 
 TTS_CONFIGURED = False
 PROJECT_UUID = None
 VOICE_UUID = None
+STREAMING_ENABLED = False
+
+TTS_SAMPLE_RATE = 16000 # Plenty for voice and keeps the MP3 payload small
+TTS_OUTPUT_FORMAT = "mp3" # Request MP3 for web compatibility
+AUDIO_STREAM_CHUNK_SIZE = 8192
+
+# Shared connection pool used to fetch generated clips server-side, so the browser
+# doesn't pay a second TLS handshake to Resemble's CDN before playback can start.
+# Bounded timeouts so a stalled CDN connection can't tie up a request thread indefinitely.
+_HTTP_POOL = urllib3.PoolManager(
+    num_pools=4,
+    maxsize=16,
+    timeout=urllib3.Timeout(connect=3.0, read=10.0), # read: max wait between chunks
+    retries=urllib3.Retry(total=2, connect=2, read=1, backoff_factor=0.2)
+)
+
+# Background workers so clip generation can overlap with other work (e.g. the LLM still streaming)
+TTS_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="resemble-tts")
+
+# Cache of previously synthesized clips: identical text with the same voice/format
+# reuses the earlier audio URL instead of paying another Resemble round trip.
+TTS_CACHE_DB_PATH = os.getenv("RESEMBLE_TTS_CACHE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_cache.db"))
+TTS_CACHE_MAXSIZE = 1024 # In-process LRU entries in front of the SQLite file
+TTS_CACHE_TTL_SECONDS = int(os.getenv("RESEMBLE_TTS_CACHE_TTL", str(7 * 24 * 3600))) # Clip links are not kept forever
+
+_tts_cache_conn = None
+_tts_memory_cache = OrderedDict() # key -> (audio_url, ts), most recently used last
+_tts_cache_lock = threading.Lock()
+_init_lock = threading.Lock() # Ensures configuration runs once even if threads race on first use
+
+
+def _get_tts_cache():
+    """Lazily opens the SQLite cache shared by all request threads."""
+    global _tts_cache_conn
+    if _tts_cache_conn is None:
+        conn = sqlite3.connect(TTS_CACHE_DB_PATH, check_same_thread=False)
+        conn.execute("CREATE TABLE IF NOT EXISTS tts_cache (key TEXT PRIMARY KEY, url TEXT, ts INTEGER)")
+        conn.commit()
+        _tts_cache_conn = conn
+    return _tts_cache_conn
+
+
+def _tts_cache_key(text, voice_uuid, sample_rate, output_format):
+    # Only whitespace is normalized: casing can change pronunciation (e.g. "US" vs "us").
+    norm_text = " ".join(text.split())
+    raw_key = f"{voice_uuid}|{sample_rate}|{output_format}|{norm_text}"
+    return hashlib.blake2b(raw_key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _remember_clip(key, entry):
+    """Puts (audio_url, ts) in the in-process LRU. Caller holds _tts_cache_lock."""
+    _tts_memory_cache[key] = entry
+    _tts_memory_cache.move_to_end(key)
+    if len(_tts_memory_cache) > TTS_CACHE_MAXSIZE:
+        _tts_memory_cache.popitem(last=False)
+
+
+def _lookup_cached_clip(key):
+    """Returns (audio_url, ts) for a cached clip, or None on a miss. Misses are not memoized."""
+    with _tts_cache_lock:
+        entry = _tts_memory_cache.get(key)
+        if entry is not None:
+            _tts_memory_cache.move_to_end(key)
+            return entry
+        row = _get_tts_cache().execute("SELECT url, ts FROM tts_cache WHERE key=?", (key,)).fetchone()
+        if row is None:
+            return None
+        entry = (row[0], row[1])
+        _remember_clip(key, entry)
+        return entry
+
+
+def _get_cached_audio_url(key):
+    try:
+        entry = _lookup_cached_clip(key)
+    except sqlite3.Error as e:
+        logger.warning(f"TTS cache lookup failed, falling back to Resemble: {e}")
+        return None
+    if entry is None:
+        return None
+    audio_url, ts = entry
+    if time.time() - ts > TTS_CACHE_TTL_SECONDS:
+        _forget_cached_clip(key) # Only this entry; the rest of the cache stays warm
+        return None
+    return audio_url
+
+
+def _store_audio_url(key, audio_url):
+    entry = (audio_url, int(time.time()))
+    try:
+        with _tts_cache_lock:
+            _remember_clip(key, entry)
+            conn = _get_tts_cache()
+            conn.execute("INSERT OR REPLACE INTO tts_cache (key, url, ts) VALUES (?, ?, ?)", (key, *entry))
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.warning(f"Failed to store clip in TTS cache: {e}")
+
+
+def _forget_cached_clip(key):
+    """Removes a stale or dead clip link from both cache layers."""
+    try:
+        with _tts_cache_lock:
+            _tts_memory_cache.pop(key, None)
+            conn = _get_tts_cache()
+            conn.execute("DELETE FROM tts_cache WHERE key=?", (key,))
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.warning(f"Failed to remove clip from TTS cache: {e}")
+
+def _api_key_fingerprint(api_key):
+    """Identifies the account the UUID cache belongs to without writing the key itself to disk."""
+    return hashlib.blake2b(api_key.encode("utf-8"), digest_size=16).hexdigest()
+
+def _load_cached_uuids(api_key):
+    """Returns (project_uuid, voice_uuid) from the discovery cache file, or (None, None) if absent, stale
+    or written for a different API key."""
+    try:
+        if time.time() - os.stat(UUID_CACHE_PATH).st_mtime > UUID_CACHE_MAX_AGE_SECONDS:
+            return None, None
+        with open(UUID_CACHE_PATH) as f:
+            cached = json.load(f)
+        if cached.get('api_key_hash') != _api_key_fingerprint(api_key):
+            logger.info(f"Ignoring {UUID_CACHE_PATH}: it was written for a different Resemble API key.")
+            return None, None
+        return cached.get('project'), cached.get('voice')
+    except (OSError, ValueError) as e:
+        if not isinstance(e, FileNotFoundError):
+            logger.warning(f"Ignoring unreadable Resemble UUID cache {UUID_CACHE_PATH}: {e}")
+        return None, None
+
+def _save_cached_uuids(project_uuid, voice_uuid, api_key):
+    try:
+        with open(UUID_CACHE_PATH, 'w') as f:
+            json.dump({'project': project_uuid, 'voice': voice_uuid, 'api_key_hash': _api_key_fingerprint(api_key)}, f)
+    except OSError as e:
+        logger.warning(f"Could not write Resemble UUID cache {UUID_CACHE_PATH}: {e}")
 
 def configure_resemble_tts():
-    global TTS_CONFIGURED, PROJECT_UUID, VOICE_UUID, Resemble # Make Resemble accessible
+    global TTS_CONFIGURED, PROJECT_UUID, VOICE_UUID, STREAMING_ENABLED, Resemble # Make Resemble accessible
 
     if TTS_CONFIGURED:
         logger.info("Resemble TTS already configured.")
         return
 
-    api_key = os.getenv(RESEMBLE_API_KEY_ENV)
-    if not api_key:
-        logger.error(f"Error: {RESEMBLE_API_KEY_ENV} environment variable not found.")
-        raise ValueError(f"{RESEMBLE_API_KEY_ENV} not set.")
+    with _init_lock:
+        if TTS_CONFIGURED: # Another thread finished configuring while we waited
+            return
+        api_key = os.getenv(RESEMBLE_API_KEY_ENV)
+        if not api_key:
+            logger.error(f"Error: {RESEMBLE_API_KEY_ENV} environment variable not found.")
+            raise ValueError(f"{RESEMBLE_API_KEY_ENV} not set.")
 
-    Resemble.api_key(api_key)
-    logger.info("Resemble API key configured.")
+        Resemble.api_key(api_key)
+        logger.info("Resemble API key configured.")
 
-    # Get Project and Voice UUIDs
-    PROJECT_UUID = os.getenv(RESEMBLE_PROJECT_UUID_ENV)
-    VOICE_UUID = os.getenv(RESEMBLE_VOICE_UUID_ENV)
+        # Streaming synthesis runs on a separate synthesis server (not available on every plan)
+        syn_server_url = os.getenv(RESEMBLE_SYN_SERVER_URL_ENV)
+        if syn_server_url:
+            Resemble.syn_server_url(syn_server_url)
+            STREAMING_ENABLED = True
+            logger.info(f"Resemble streaming synthesis enabled via {syn_server_url}.")
 
-    if PROJECT_UUID and VOICE_UUID:
-        logger.info(f"Using Project UUID: {PROJECT_UUID} and Voice UUID: {VOICE_UUID} from environment variables.")
-    else:
-        logger.warning("RESEMBLE_PROJECT_UUID or RESEMBLE_VOICE_UUID not set. Attempting to discover them.")
-        try:
-            projects = Resemble.v2.projects.all(1, 10)
-            if not projects or not projects.get('items'):
-                logger.error("No projects found in Resemble account.")
-                raise ValueError("No Resemble projects found.")
-            PROJECT_UUID = PROJECT_UUID or projects['items'][0]['uuid']
+        # Get Project and Voice UUIDs
+        PROJECT_UUID = os.getenv(RESEMBLE_PROJECT_UUID_ENV)
+        VOICE_UUID = os.getenv(RESEMBLE_VOICE_UUID_ENV)
 
-            voices = Resemble.v2.voices.all(1, 10)
-            if not voices or not voices.get('items'):
-                logger.error(f"No voices found in Resemble project {PROJECT_UUID}.")
-                raise ValueError("No Resemble voices found.")
-            VOICE_UUID = VOICE_UUID or voices['items'][0]['uuid']
+        if PROJECT_UUID and VOICE_UUID:
+            logger.info(f"Using Project UUID: {PROJECT_UUID} and Voice UUID: {VOICE_UUID} from environment variables.")
+        else:
+            cached_project_uuid, cached_voice_uuid = _load_cached_uuids(api_key)
+            if cached_project_uuid and cached_voice_uuid:
+                PROJECT_UUID = PROJECT_UUID or cached_project_uuid
+                VOICE_UUID = VOICE_UUID or cached_voice_uuid
+                logger.info(f"Using Project UUID: {PROJECT_UUID} and Voice UUID: {VOICE_UUID} from {UUID_CACHE_PATH}.")
 
-            logger.info(f"Discovered and using Project UUID: {PROJECT_UUID}, Voice UUID: {VOICE_UUID}")
-            logger.warning("For production, it's recommended to set RESEMBLE_PROJECT_UUID and RESEMBLE_VOICE_UUID environment variables.")
+        if not (PROJECT_UUID and VOICE_UUID):
+            logger.warning("RESEMBLE_PROJECT_UUID or RESEMBLE_VOICE_UUID not set. Attempting to discover them.")
+            try:
+                projects = Resemble.v2.projects.all(1, 10)
+                if not projects or not projects.get('items'):
+                    logger.error("No projects found in Resemble account.")
+                    raise ValueError("No Resemble projects found.")
+                PROJECT_UUID = PROJECT_UUID or projects['items'][0]['uuid']
 
-        except Exception as e:
-            logger.error(f"Error discovering Resemble project/voice UUIDs: {e}", exc_info=True)
-            raise ValueError(f"Could not determine Resemble project/voice UUIDs: {e}")
+                voices = Resemble.v2.voices.all(1, 10)
+                if not voices or not voices.get('items'):
+                    logger.error(f"No voices found in Resemble project {PROJECT_UUID}.")
+                    raise ValueError("No Resemble voices found.")
+                VOICE_UUID = VOICE_UUID or voices['items'][0]['uuid']
 
-    TTS_CONFIGURED = True
-    logger.info("Resemble TTS configured successfully.")
+                logger.info(f"Discovered and using Project UUID: {PROJECT_UUID}, Voice UUID: {VOICE_UUID}")
+                _save_cached_uuids(PROJECT_UUID, VOICE_UUID, api_key)
+                logger.warning("For production, it's recommended to set RESEMBLE_PROJECT_UUID and RESEMBLE_VOICE_UUID environment variables.")
 
+            except Exception as e:
+                logger.error(f"Error discovering Resemble project/voice UUIDs: {e}", exc_info=True)
+                raise ValueError(f"Could not determine Resemble project/voice UUIDs: {e}")
 
-def synthesize_speech_resemble(text_to_speak: str, title: str = "ChatbotResponse"):
-    global TTS_CONFIGURED, PROJECT_UUID, VOICE_UUID, Resemble
+        TTS_CONFIGURED = True
+        logger.info("Resemble TTS configured successfully.")
 
+def _ensure_tts_ready():
+    """Configures Resemble if needed. Returns an error dict on failure, None when ready."""
     if not TTS_CONFIGURED:
         try:
             logger.info("Resemble TTS not configured. Attempting to configure now...")
@@ -80,6 +246,20 @@ def synthesize_speech_resemble(text_to_speak: str, title: str = "ChatbotResponse
     if not PROJECT_UUID or not VOICE_UUID:
         logger.error("PROJECT_UUID or VOICE_UUID for Resemble TTS is not set.")
         return {"error": "Resemble TTS project/voice not configured."}
+    return None
+
+def synthesize_speech_resemble(text_to_speak: str, title: str = "ChatbotResponse"):
+    global TTS_CONFIGURED, PROJECT_UUID, VOICE_UUID, Resemble
+
+    config_error = _ensure_tts_ready()
+    if config_error:
+        return config_error
+
+    cache_key = _tts_cache_key(text_to_speak, VOICE_UUID, TTS_SAMPLE_RATE, TTS_OUTPUT_FORMAT)
+    cached_url = _get_cached_audio_url(cache_key)
+    if cached_url:
+        logger.info(f"Resemble TTS cache hit for text: '{text_to_speak[:50]}...'")
+        return {"audio_url": cached_url}
 
     try:
         logger.info(f"Requesting speech synthesis from Resemble for text: '{text_to_speak[:50]}...'")
@@ -99,8 +279,8 @@ def synthesize_speech_resemble(text_to_speak: str, title: str = "ChatbotResponse
             title=title,
             is_public=False, # Keep clips private unless specified
             is_archived=False,
-            sample_rate=22050, # Common sample rate, can be 44100 for higher quality
-            output_format="mp3" # Request MP3 for web compatibility
+            sample_rate=TTS_SAMPLE_RATE,
+            output_format=TTS_OUTPUT_FORMAT
         )
 
         if clip_response and clip_response.get('success') and clip_response.get('item'):
@@ -110,6 +290,7 @@ def synthesize_speech_resemble(text_to_speak: str, title: str = "ChatbotResponse
 
             if audio_url:
                 logger.info(f"Resemble TTS successful. Audio URL: {audio_url}")
+                _store_audio_url(cache_key, audio_url)
                 return {"audio_url": audio_url} # Return the URL of the MP3 audio
             else:
                 logger.error(f"Resemble TTS response missing audio URL. Response: {clip_response}")
@@ -123,6 +304,87 @@ def synthesize_speech_resemble(text_to_speak: str, title: str = "ChatbotResponse
         logger.error(f"Error during Resemble speech synthesis: {e}", exc_info=True)
         return {"error": f"Exception during Resemble speech synthesis: {str(e)}"}
 
+def synthesize_speech_resemble_async(text_to_speak: str, title: str = "ChatbotResponse"):
+    """Starts synthesize_speech_resemble on the TTS worker pool. Returns a Future of its result dict."""
+    return TTS_EXECUTOR.submit(synthesize_speech_resemble, text_to_speak, title)
+
+def stream_speech_resemble(text_to_speak: str):
+    """Synthesizes speech for streaming playback. Returns {"stream", "mimetype"} or {"error": ...}.
+
+    Previously synthesized text is served from the clip cache. Otherwise, with streaming enabled,
+    audio is forwarded chunk by chunk as Resemble generates it; without it, the clip is created
+    with create_sync and then downloaded.
+    """
+    config_error = _ensure_tts_ready()
+    if config_error:
+        return config_error
+
+    cache_key = _tts_cache_key(text_to_speak, VOICE_UUID, TTS_SAMPLE_RATE, TTS_OUTPUT_FORMAT)
+    cached_url = _get_cached_audio_url(cache_key)
+    if cached_url:
+        stream_result = open_audio_stream(cached_url)
+        if "error" not in stream_result:
+            return stream_result
+        # The clip link expired or was removed on Resemble's side; drop it and synthesize again
+        logger.warning(f"Cached clip could not be fetched, re-synthesizing: {stream_result['error']}")
+        _forget_cached_clip(cache_key)
+        synthesis_result = synthesize_speech_resemble(text_to_speak)
+        if "error" in synthesis_result:
+            return synthesis_result
+        return open_audio_stream(synthesis_result["audio_url"])
+
+    if not STREAMING_ENABLED:
+        synthesis_result = synthesize_speech_resemble(text_to_speak)
+        if "error" in synthesis_result:
+            return synthesis_result
+        return open_audio_stream(synthesis_result["audio_url"])
+
+    try:
+        logger.info(f"Streaming speech synthesis from Resemble for text: '{text_to_speak[:50]}...'")
+        # The streaming endpoint produces WAV (PCM); MP3 is only offered for whole clips
+        chunks = Resemble.v2.clips.stream(
+            PROJECT_UUID,
+            VOICE_UUID,
+            text_to_speak,
+            buffer_size=AUDIO_STREAM_CHUNK_SIZE,
+            ignore_wav_header=False,
+            sample_rate=TTS_SAMPLE_RATE
+        )
+        first_chunk = next(chunks) # Surface API errors before the HTTP response starts
+    except StopIteration:
+        logger.error("Resemble streaming synthesis returned no audio.")
+        return {"error": "Resemble TTS stream returned no audio."}
+    except Exception as e:
+        logger.error(f"Error during Resemble streaming synthesis: {e}", exc_info=True)
+        return {"error": f"Exception during Resemble streaming synthesis: {str(e)}"}
+
+    def _iter_chunks():
+        yield first_chunk
+        yield from chunks
+
+    return {"stream": _iter_chunks(), "mimetype": "audio/wav"}
+
+def open_audio_stream(audio_url: str, chunk_size: int = AUDIO_STREAM_CHUNK_SIZE):
+    """Opens a synthesized clip for streaming. Returns {"stream": iterator of bytes, "mimetype"} or {"error": ...}."""
+    try:
+        response = _HTTP_POOL.request("GET", audio_url, preload_content=False)
+    except urllib3.exceptions.HTTPError as e:
+        logger.error(f"Error fetching Resemble audio from {audio_url}: {e}", exc_info=True)
+        return {"error": f"Failed to fetch synthesized audio: {str(e)}"}
+
+    if response.status != 200:
+        response.release_conn()
+        logger.error(f"Fetching Resemble audio failed with HTTP {response.status}: {audio_url}")
+        return {"error": f"Failed to fetch synthesized audio (HTTP {response.status})."}
+
+    def _iter_chunks():
+        try:
+            yield from response.stream(chunk_size)
+        finally:
+            response.release_conn() # Return the connection to the pool even if the client disconnects
+
+    return {"stream": _iter_chunks(), "mimetype": response.headers.get("Content-Type", "audio/mpeg")}
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     logger.info("Running resemble_tts_client.py in standalone mode.")
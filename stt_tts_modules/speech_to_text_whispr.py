@@ -1,46 +1,508 @@
+import gc
+import io
+import time
+import hashlib
+import importlib.util
+import inspect
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future
 import torch
-from transformers import pipeline
+import torchaudio
+import numpy as np
+import soundfile as sf
+from transformers import pipeline, TextIteratorStreamer, StoppingCriteria, StoppingCriteriaList
+from transformers.pipelines.audio_utils import ffmpeg_read
 import os
 
+# faster-whisper (CTranslate2) is several times faster than the transformers pipeline
+# at equal accuracy. It is optional: without it the HF pipeline is used.
+# Set STT_BACKEND=transformers (or faster-whisper) to force a backend instead of "auto".
+# STT_BACKEND=trtllm uses a prebuilt TensorRT-LLM engine on NVIDIA GPUs (see _TrtllmWhisper).
+# STT_BACKEND=onnx runs an exported (optionally INT8-quantized) model with ONNX Runtime (see _load_onnx_pipeline).
+try:
+    from faster_whisper import WhisperModel
+except ImportError:
+    WhisperModel = None
+
 ASR_PIPELINE = None
-DEVICE = "cuda:0" if torch.cuda.is_available() else "cpu"
+DEVICE = os.getenv("STT_CUDA_DEVICE", "cuda:0") if torch.cuda.is_available() else "cpu"
 MODEL_LOADED = False
+LOADED_MODEL_NAME = None
+STT_BACKEND = None # "faster-whisper", "transformers", "onnx" or "trtllm", set once a model is loaded
+REQUESTED_STT_BACKEND = os.getenv("STT_BACKEND", "auto")
+BEAM_SIZE = int(os.getenv("STT_BEAM_SIZE", "1")) # faster-whisper beam width; greedy (1) for lowest latency
+# Language code (e.g. "en", "de") for single-language deployments. Skips language detection;
+# unset, every backend except TensorRT-LLM detects the language per recording.
+STT_LANGUAGE = os.getenv("STT_LANGUAGE") or None
+TRTLLM_ENGINE_DIR = os.getenv("STT_TRTLLM_ENGINE_DIR", "whisper_trtllm_engine")
+TRTLLM_LANGUAGE = os.getenv("STT_TRTLLM_LANGUAGE") or STT_LANGUAGE or "en" # TRT-LLM engine decodes with a fixed language
+TRTLLM_MAX_NEW_TOKENS = 96
+ONNX_MODEL_DIR = os.getenv("STT_ONNX_MODEL_DIR", "whisper_onnx")
+ONNX_QUANTIZED = os.getenv("STT_ONNX_QUANTIZED", "0") == "1" # Load the *_quantized.onnx INT8 files on CPU
+
+# Default model: multilingual 'whisper-large-v3-turbo' on GPU (large-v3 encoder with only 4 decoder
+# layers, so it decodes far faster than large-v3 at similar accuracy); the small 'whisper-base' on CPU.
+# STT_MODEL overrides either, e.g. "distil-whisper/distil-small.en" for English-only use.
+DEFAULT_MODEL_NAME = os.getenv("STT_MODEL") or (
+    "openai/whisper-large-v3-turbo" if DEVICE.startswith("cuda") else "openai/whisper-base"
+)
+TARGET_SAMPLE_RATE = 16000 # Whisper's native input rate
+PIPELINE_BATCH_SIZE = 24 # 30s chunks decoded in parallel by the transformers pipeline
+LONG_AUDIO_SECONDS = 600 # Files longer than this are streamed through the pipeline in windows
+STREAM_WINDOW_SECONDS = 30
+WARMUP_SECONDS = 15 # Length of the silent clip run through a freshly loaded model
+
+# Multi-GPU: STT_GPU_IDS lists GPU indices (e.g. "0,1") to spread transcriptions across.
+# The transformers backend builds one pipeline per GPU on first use and sends each request
+# to the GPU with the fewest in flight; faster-whisper gets all of them as device_index.
+STT_GPU_IDS_SETTING = os.getenv("STT_GPU_IDS", "")
+STT_GPU_IDS = [] # Parsed from STT_GPU_IDS_SETTING by _configure_cuda_device() when a model is loaded
+_PIPELINES = {} # GPU index -> transformers pipeline, for GPUs other than DEVICE
+_pipelines_lock = threading.Lock()
+_gpu_load_locks = {} # GPU index -> lock held while the model is loaded onto that GPU
+_eager_forwards = {} # id(model) -> its forward before torch.compile, restored if graph capture fails
+_generate_locks = {} # id(pipeline) -> lock serializing that pipeline's forward passes
+_generate_locks_lock = threading.Lock()
+_pipeline_load = {} # GPU index -> transcriptions currently running on it
+_pipeline_load_lock = threading.Lock()
+
+# Micro-batching for the transformers backend: concurrent /transcribe requests arriving
+# within BATCH_WINDOW_S of each other share one batched forward pass on the model.
+BATCH_WINDOW_S = 0.02
+MAX_BATCH = 16
+_batch_queue = queue.Queue()
+_batcher_threads = []
+_batcher_lock = threading.Lock()
+
+# Transcriptions of recently seen audio, keyed by model and a hash of the file bytes,
+# so retries and replays of the same recording skip inference entirely.
+TRANSCRIPTION_CACHE_SIZE = 128
+TRANSCRIPTION_CACHE_MAX_BYTES = 10 * 1024 * 1024 # Larger uploads are neither hashed nor cached
+_transcription_cache = OrderedDict()
+_transcription_cache_lock = threading.Lock()
+
+def _configure_cuda_device():
+    """Validates STT_CUDA_DEVICE and STT_GPU_IDS and sets up DEVICE. Raises ValueError on a bad setting."""
+    global STT_GPU_IDS
+    if not torch.cuda.is_available():
+        return
+    gpu_count = torch.cuda.device_count()
+    try:
+        device = torch.device(DEVICE)
+    except RuntimeError:
+        device = None
+    if device is None or device.type != "cuda" or (device.index or 0) >= gpu_count:
+        raise ValueError(f"Invalid STT_CUDA_DEVICE '{DEVICE}': expected cuda:<index> with an index below {gpu_count}.")
+    try:
+        gpu_ids = [int(i) for i in STT_GPU_IDS_SETTING.split(",") if i.strip()]
+    except ValueError:
+        raise ValueError(f"Invalid STT_GPU_IDS '{STT_GPU_IDS_SETTING}': expected comma-separated GPU indices, e.g. \"0,1\".") from None
+    if any(not 0 <= i < gpu_count for i in gpu_ids):
+        raise ValueError(f"Invalid STT_GPU_IDS '{STT_GPU_IDS_SETTING}': this machine has GPUs 0-{gpu_count - 1}.")
+    STT_GPU_IDS = gpu_ids
+
+    # The current device is per thread: this covers model loading, worker threads set it themselves
+    torch.cuda.set_device(device)
+    # TF32 matmuls/convolutions on Ampere and newer; cuDNN picks the fastest conv algorithm per input shape
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    torch.backends.cudnn.benchmark = True
+
+def _faster_whisper_model_name(model_name):
+    # faster-whisper names its converted checkpoints without the HF org prefix, e.g. "base" or "large-v3-turbo"
+    return model_name.split("/")[-1].replace("whisper-", "") # Also maps distil-whisper/distil-small.en
+
+def _load_faster_whisper_model(model_name):
+    return WhisperModel(
+        _faster_whisper_model_name(model_name),
+        device="cuda" if DEVICE.startswith("cuda") else "cpu",
+        device_index=STT_GPU_IDS or (torch.device(DEVICE).index or 0), # A list runs concurrent calls on several GPUs
+        # INT8 weights everywhere; activations in FP16 only where tensor cores make it fast
+        compute_type="int8_float16" if _use_fp16() else "int8"
+    )
+
+class _TrtllmWhisper:
+    """Whisper served by a prebuilt TensorRT-LLM encoder/decoder engine.
+
+    Build the engine from the same HF checkpoint with TensorRT-LLM's whisper example
+    (convert_checkpoint.py, then trtllm-build with --gemm_plugin float16 --gpt_attention_plugin float16)
+    into STT_TRTLLM_ENGINE_DIR. Longer audio is decoded as consecutive 30s windows in TRTLLM_LANGUAGE.
+    """
+    def __init__(self, engine_dir, model_name):
+        from tensorrt_llm.runtime import ModelRunnerCpp
+        from transformers import WhisperProcessor
+
+        self.processor = WhisperProcessor.from_pretrained(model_name)
+        self.runner = ModelRunnerCpp.from_dir(
+            engine_dir=engine_dir,
+            is_enc_dec=True,
+            max_batch_size=1,
+            max_input_len=3000, # Mel frames in one 30s window
+            max_output_len=TRTLLM_MAX_NEW_TOKENS,
+            max_beam_width=1
+        )
+        tokenizer = self.processor.tokenizer
+        self.prompt_ids = tokenizer.convert_tokens_to_ids(
+            ["<|startoftranscript|>", f"<|{TRTLLM_LANGUAGE}|>", "<|transcribe|>", "<|notimestamps|>"]
+        )
+        self.eot_id = tokenizer.convert_tokens_to_ids("<|endoftext|>")
+        # The runner is built for a single sequence; request threads take turns on it
+        self._generate_lock = threading.Lock()
+
+    def __call__(self, samples):
+        window = STREAM_WINDOW_SECONDS * TARGET_SAMPLE_RATE # The engine's encoder input is one 30s window
+        texts = [self._decode_window(samples[start:start + window]) for start in range(0, max(len(samples), 1), window)]
+        return {"text": " ".join(text for text in texts if text), "language": TRTLLM_LANGUAGE}
+
+    def _decode_window(self, samples):
+        features = self.processor.feature_extractor(
+            samples, sampling_rate=TARGET_SAMPLE_RATE, return_tensors="pt", device=DEVICE
+        ).input_features
+        features = features.to(DEVICE, dtype=torch.float16).transpose(1, 2) # [1, frames, n_mels]
+        with self._generate_lock, torch.inference_mode():
+            outputs = self.runner.generate(
+                batch_input_ids=[torch.tensor(self.prompt_ids, dtype=torch.int32)],
+                encoder_input_features=[features[0]],
+                encoder_output_lengths=torch.tensor([features.shape[1] // 2], dtype=torch.int32), # Encoder downsamples 2x
+                max_new_tokens=TRTLLM_MAX_NEW_TOKENS,
+                end_id=self.eot_id,
+                pad_id=self.eot_id,
+                num_beams=1,
+                output_sequence_lengths=True,
+                return_dict=True
+            )
+        sequence_length = int(outputs["sequence_lengths"][0][0])
+        output_ids = outputs["output_ids"][0][0][len(self.prompt_ids):sequence_length].tolist()
+        return self.processor.tokenizer.decode(output_ids, skip_special_tokens=True).strip()
+
+def _select_backend():
+    if REQUESTED_STT_BACKEND == "trtllm":
+        if DEVICE.startswith("cuda") and os.path.isdir(TRTLLM_ENGINE_DIR):
+            return "trtllm"
+        print(f"STT_BACKEND=trtllm needs a CUDA device and an engine in '{TRTLLM_ENGINE_DIR}'. Falling back.")
+    elif REQUESTED_STT_BACKEND == "onnx":
+        if importlib.util.find_spec("optimum") is not None and os.path.isdir(ONNX_MODEL_DIR):
+            return "onnx"
+        print(f"STT_BACKEND=onnx needs optimum[onnxruntime] and an exported model in '{ONNX_MODEL_DIR}'. Falling back.")
+    elif REQUESTED_STT_BACKEND in ("faster-whisper", "transformers"):
+        if REQUESTED_STT_BACKEND == "faster-whisper" and WhisperModel is None:
+            raise ImportError("STT_BACKEND=faster-whisper but the faster-whisper package is not installed.")
+        return REQUESTED_STT_BACKEND
+    return "faster-whisper" if WhisperModel is not None else "transformers"
+
+def _use_fp16(device=DEVICE):
+    # FP16 only pays off with tensor cores (Volta, sm_70, and newer); older GPUs and CPUs stay in FP32
+    return device.startswith("cuda") and torch.cuda.get_device_capability(device)[0] >= 7
+
+def _use_flash_attention(device=DEVICE):
+    # FlashAttention 2 needs an Ampere (sm_80) or newer GPU, FP16 weights and the flash-attn package
+    return (device.startswith("cuda") and torch.cuda.get_device_capability(device)[0] >= 8
+            and importlib.util.find_spec("flash_attn") is not None)
+
+def _extract_features_on_device(feature_extractor, device=DEVICE):
+    """Makes a Whisper feature extractor compute its STFT and log-mel spectrogram on device.
+
+    The pipeline calls the extractor without a device, so the FFT would otherwise run on the
+    CPU for every 30s chunk. The class is swapped in place so isinstance checks still pass.
+    """
+    extractor_class = type(feature_extractor)
+    if "device" not in inspect.signature(extractor_class.__call__).parameters:
+        return # Older transformers: only the numpy (CPU) implementation exists
+
+    class _OnDeviceFeatureExtractor(extractor_class):
+        def __call__(self, *args, **kwargs):
+            kwargs.setdefault("device", device)
+            return super().__call__(*args, **kwargs)
+
+    feature_extractor.__class__ = _OnDeviceFeatureExtractor
+
+def _build_pipeline(model_name, attn_implementation, device):
+    return pipeline(
+        "automatic-speech-recognition",
+        model=model_name,
+        chunk_length_s=30,
+        device=device,
+        torch_dtype=torch.float16 if _use_fp16(device) else torch.float32, # FP16 runs on the GPU's tensor cores
+        model_kwargs={
+            "attn_implementation": attn_implementation,
+            "low_cpu_mem_usage": True, # Weights go straight into the final dtype, no extra FP32 copy
+            "use_safetensors": True # Memory-mapped, no pickle
+        },
+        framework="pt" # Ensure PyTorch is used
+    )
+
+def _load_transformers_pipeline(model_name, device=DEVICE):
+    use_cuda = device.startswith("cuda")
+    asr_pipeline = None
+    if _use_flash_attention(device):
+        try:
+            asr_pipeline = _build_pipeline(model_name, "flash_attention_2", device)
+        except (ImportError, ValueError) as e: # flash-attn installed but unusable with this build/model
+            print(f"FlashAttention 2 not available for STT model, using SDPA: {e}")
+    if asr_pipeline is None:
+        # PyTorch's fused scaled_dot_product_attention kernels (memory-efficient/flash on GPU)
+        asr_pipeline = _build_pipeline(model_name, "sdpa", device)
+    _apply_fixed_language(asr_pipeline)
+    if use_cuda:
+        _extract_features_on_device(asr_pipeline.feature_extractor, device)
+        _compile_model(asr_pipeline)
+    else:
+        # CPU: int8 weights for the linear layers (oneDNN VNNI kernels), about half the memory of FP32
+        try:
+            asr_pipeline.model = torch.ao.quantization.quantize_dynamic(asr_pipeline.model, {torch.nn.Linear}, dtype=torch.qint8)
+        except Exception as e:
+            print(f"Dynamic INT8 quantization not applied to STT model, using FP32: {e}")
+    return asr_pipeline
+
+def _apply_fixed_language(asr_pipeline):
+    if STT_LANGUAGE and getattr(asr_pipeline.model.generation_config, "is_multilingual", True):
+        # Fixed decoder prompt (<|lang|><|transcribe|>) set once, so generate() doesn't detect the language
+        asr_pipeline.model.generation_config.language = STT_LANGUAGE
+        asr_pipeline.model.generation_config.task = "transcribe"
+
+def _load_onnx_pipeline():
+    """Wraps an ONNX Runtime export of Whisper in the transformers ASR pipeline.
 
-# Default model is now the multilingual 'whisper-base'
-DEFAULT_MODEL_NAME = "openai/whisper-base"
+    Export the model once with optimum. For GPUs, an FP16 export optimized for CUDA:
+        optimum-cli export onnx --model openai/whisper-base --optimize O4 --device cuda whisper_onnx/
+    For CPUs, a plain FP32 export, quantized to INT8 next to it (run with STT_ONNX_QUANTIZED=1):
+        optimum-cli export onnx --model openai/whisper-base --device cpu whisper_onnx/
+        optimum-cli onnxruntime quantize --avx512_vnni --onnx_model whisper_onnx/ -o whisper_onnx/
+    """
+    from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+    from transformers import AutoProcessor
 
-def load_stt_model(model_name=DEFAULT_MODEL_NAME): # Use the new default
-    global ASR_PIPELINE, MODEL_LOADED, DEVICE
+    use_cuda = DEVICE.startswith("cuda")
+    model_files = {}
+    if ONNX_QUANTIZED and not use_cuda:
+        # The quantizer writes *_quantized.onnx beside the FP32 files; name them or the FP32 ones are loaded
+        model_files = {
+            "encoder_file_name": "encoder_model_quantized.onnx",
+            "decoder_file_name": "decoder_model_quantized.onnx",
+            "decoder_with_past_file_name": "decoder_with_past_model_quantized.onnx",
+            "use_merged": False
+        }
+    elif ONNX_QUANTIZED:
+        print("STT_ONNX_QUANTIZED is only used on CPU; loading the GPU export as is.")
+    model = ORTModelForSpeechSeq2Seq.from_pretrained(
+        ONNX_MODEL_DIR,
+        provider="CUDAExecutionProvider" if use_cuda else "CPUExecutionProvider",
+        use_io_binding=use_cuda, # Inputs/outputs stay on the GPU between encoder and decoder runs
+        **model_files
+    )
+    processor = AutoProcessor.from_pretrained(ONNX_MODEL_DIR) # Saved next to the model by the export
+    asr_pipeline = pipeline(
+        "automatic-speech-recognition",
+        model=model,
+        tokenizer=processor.tokenizer,
+        feature_extractor=processor.feature_extractor,
+        chunk_length_s=30
+    )
+    _apply_fixed_language(asr_pipeline)
+    return asr_pipeline
+
+def _uses_hf_pipeline():
+    # Backends whose ASR_PIPELINE is a transformers pipeline (batching, return_language, windows)
+    return STT_BACKEND in ("transformers", "onnx")
+
+def _compile_model(asr_pipeline):
+    """Compiles the model's forward with CUDA Graphs; they are captured by the warmup run (_warmup_pipeline)."""
+    model = asr_pipeline.model
+    eager_forward = model.forward
+    try:
+        # A static KV cache keeps tensor shapes fixed across decoding steps, so captured graphs can be replayed
+        model.generation_config.cache_implementation = "static"
+        model.forward = torch.compile(model.forward, mode="reduce-overhead")
+        _eager_forwards[id(model)] = eager_forward
+    except Exception as e:
+        _restore_eager_forward(model, eager_forward)
+        print(f"torch.compile not applied to STT model, running in eager mode: {e}")
+
+def _restore_eager_forward(model, eager_forward):
+    model.forward = eager_forward
+    model.generation_config.cache_implementation = None
+
+def get_pipeline(gpu_id):
+    """Returns the transformers pipeline on cuda:<gpu_id>.
+
+    load_stt_model() loads every GPU in STT_GPU_IDS up front; any other GPU gets the current
+    model loaded on first use.
+    """
+    if gpu_id == (torch.device(DEVICE).index or 0):
+        return ASR_PIPELINE
+    asr_pipeline = _PIPELINES.get(gpu_id) # No lock: requests for loaded GPUs never wait on a loading one
+    if asr_pipeline is not None:
+        return asr_pipeline
+    with _pipelines_lock:
+        gpu_load_lock = _gpu_load_locks.setdefault(gpu_id, threading.Lock())
+    with gpu_load_lock:
+        if gpu_id not in _PIPELINES:
+            print(f"Loading STT model '{LOADED_MODEL_NAME}' on additional device cuda:{gpu_id}...")
+            with torch.cuda.device(gpu_id):
+                asr_pipeline = _load_transformers_pipeline(LOADED_MODEL_NAME, f"cuda:{gpu_id}")
+                try:
+                    _warmup_pipeline(asr_pipeline)
+                except Exception as e:
+                    print(f"STT model warmup on cuda:{gpu_id} failed, its first transcription may be slower: {e}")
+            with _pipelines_lock:
+                _PIPELINES[gpu_id] = asr_pipeline
+        return _PIPELINES[gpu_id]
+
+@contextmanager
+def _acquire_pipeline(gpu_id=None):
+    """Yields the transformers pipeline for gpu_id, or for the least loaded of STT_GPU_IDS."""
+    if (gpu_id is None and not STT_GPU_IDS) or STT_BACKEND != "transformers":
+        yield ASR_PIPELINE # Single GPU; the ONNX Runtime session also stays on DEVICE
+        return
+    with _pipeline_load_lock:
+        if gpu_id is None:
+            gpu_id = min(STT_GPU_IDS, key=lambda i: _pipeline_load.get(i, 0))
+        _pipeline_load[gpu_id] = _pipeline_load.get(gpu_id, 0) + 1
+    try:
+        asr_pipeline = get_pipeline(gpu_id)
+        with torch.cuda.device(gpu_id): # Compiled graphs and new tensors belong to that GPU
+            yield asr_pipeline
+    finally:
+        with _pipeline_load_lock:
+            _pipeline_load[gpu_id] -= 1
+
+def _generate_lock(asr_pipeline):
+    """Returns the lock held around every forward pass on asr_pipeline.
+
+    With the static cache used by torch.compile, all generate() calls on a model decode into
+    the same preallocated model._cache, so two at once would corrupt each other's output.
+    """
+    with _generate_locks_lock:
+        return _generate_locks.setdefault(id(asr_pipeline), threading.Lock())
+
+class _StopOnEvent(StoppingCriteria):
+    """Ends generate() after the current token once event is set."""
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+def _warmup_samples():
+    return np.zeros(WARMUP_SECONDS * TARGET_SAMPLE_RATE, dtype=np.float32)
+
+def _warmup_pipeline(asr_pipeline):
+    """Runs the silent clip through a transformers pipeline exactly as requests do, under its
+    generate lock and in inference mode, so a compiled model captures its graphs for that setup."""
+    def run_warmup():
+        with _generate_lock(asr_pipeline), torch.inference_mode():
+            asr_pipeline({"raw": _warmup_samples(), "sampling_rate": TARGET_SAMPLE_RATE})
+
+    model = asr_pipeline.model
+    eager_forward = _eager_forwards.pop(id(model), None)
+    try:
+        run_warmup()
+    except Exception as e:
+        if eager_forward is None:
+            raise
+        _restore_eager_forward(model, eager_forward)
+        print(f"torch.compile not applied to STT model, running in eager mode: {e}")
+        run_warmup()
+
+def _warmup_model():
+    """Runs a silent clip through the loaded backend so the first real request doesn't pay
+    for CUDA context setup, allocator growth, kernel autotuning or graph capture."""
+    try:
+        if STT_BACKEND == "faster-whisper":
+            segments, _ = ASR_PIPELINE.transcribe(_warmup_samples(), beam_size=BEAM_SIZE) # No VAD: silence must be decoded
+            list(segments) # Segments are decoded lazily
+        elif STT_BACKEND == "trtllm":
+            ASR_PIPELINE(_warmup_samples())
+        else:
+            _warmup_pipeline(ASR_PIPELINE)
+        print(f"STT model '{LOADED_MODEL_NAME}' warmed up.")
+    except Exception as e:
+        print(f"STT model warmup failed, the first transcription may be slower: {e}")
+
+def _release_model():
+    """Drops the loaded model and hands its cached GPU memory back before another one is loaded."""
+    global ASR_PIPELINE
+    with _pipelines_lock:
+        released = [p for p in (ASR_PIPELINE, *_PIPELINES.values()) if p is not None]
+        ASR_PIPELINE = None
+        _PIPELINES.clear()
+        _eager_forwards.clear()
+    with _generate_locks_lock:
+        _generate_locks.clear()
+    if not released:
+        return
+    for asr_pipeline in released:
+        model = getattr(asr_pipeline, "model", None)
+        if isinstance(model, torch.nn.Module):
+            model.cpu() # Moves the weights off the GPU even if something else still references the model
+    asr_pipeline = model = None
+    released.clear()
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def load_stt_model(model_name=DEFAULT_MODEL_NAME, warmup=True): # Use the new default
+    """Loads model_name with the selected backend. warmup=False only fetches and instantiates the
+    weights, e.g. for an image build, where warming the model up would be thrown away."""
+    global ASR_PIPELINE, MODEL_LOADED, DEVICE, LOADED_MODEL_NAME, STT_BACKEND
 
     # Check if the requested model is already loaded
-    if MODEL_LOADED and ASR_PIPELINE and hasattr(ASR_PIPELINE, 'model') and \
-       hasattr(ASR_PIPELINE.model, 'name_or_path') and ASR_PIPELINE.model.name_or_path == model_name:
+    if MODEL_LOADED and ASR_PIPELINE is not None and LOADED_MODEL_NAME == model_name:
         print(f"STT model '{model_name}' already loaded.")
         return
 
+    _configure_cuda_device() # Fails here with a clear message rather than at import time
+
     # If a different model was loaded, or not loaded, proceed to load the requested one
     MODEL_LOADED = False # Reset flag if we're changing models or loading for the first time
-    ASR_PIPELINE = None  # Ensure pipeline is reset before loading new model
+    _release_model() # Free the previous model's VRAM before loading new model
+    LOADED_MODEL_NAME = None
+
+    backend = _select_backend()
+    if backend == "trtllm":
+        try:
+            print(f"Loading TensorRT-LLM Whisper engine from '{TRTLLM_ENGINE_DIR}'...")
+            ASR_PIPELINE = _TrtllmWhisper(TRTLLM_ENGINE_DIR, model_name)
+            STT_BACKEND = backend
+            LOADED_MODEL_NAME = model_name
+            MODEL_LOADED = True
+            print(f"STT model '{model_name}' loaded successfully with {backend} on {DEVICE}.")
+            if warmup:
+                _warmup_model()
+            return
+        except Exception as e:
+            ASR_PIPELINE = None
+            print(f"TensorRT-LLM engine could not be loaded, falling back to the default backend: {e}")
+            backend = "faster-whisper" if WhisperModel is not None else "transformers"
 
-    print(f"Loading STT model ({model_name}) on device: {DEVICE}...")
+    print(f"Loading STT model ({model_name}) with {backend} on device: {DEVICE}...")
     try:
-        ASR_PIPELINE = pipeline(
-            "automatic-speech-recognition",
-            model=model_name,
-            chunk_length_s=30,
-            device=DEVICE,
-            framework="pt" # Ensure PyTorch is used
-        )
+        if backend == "faster-whisper":
+            ASR_PIPELINE = _load_faster_whisper_model(model_name)
+        elif backend == "onnx":
+            ASR_PIPELINE = _load_onnx_pipeline()
+        else:
+            ASR_PIPELINE = _load_transformers_pipeline(model_name)
+        STT_BACKEND = backend
+        LOADED_MODEL_NAME = model_name
+        if backend == "transformers":
+            for gpu_id in STT_GPU_IDS:
+                get_pipeline(gpu_id) # Loaded now rather than inside the first request routed to that GPU
         MODEL_LOADED = True
-        print(f"STT Pipeline '{model_name}' loaded successfully on {DEVICE}.")
+        print(f"STT model '{model_name}' loaded successfully with {backend} on {DEVICE}.")
     except Exception as e:
         MODEL_LOADED = False
         ASR_PIPELINE = None # Explicitly set to None on failure
-        print(f"Error loading STT pipeline '{model_name}': {e}")
+        print(f"Error loading STT model '{model_name}' with {backend}: {e}")
         raise # Re-raise to notify the caller (app.py)
+    if warmup:
+        _warmup_model()
 
-def transcribe_audio_file(audio_filepath):
-    global ASR_PIPELINE, MODEL_LOADED
+def _ensure_model_loaded():
+    """Loads the default model if needed. Returns an error dict on failure, None when ready."""
     if not MODEL_LOADED or ASR_PIPELINE is None:
         print("STT model not pre-loaded or ASR_PIPELINE is None. Attempting to load default model...")
         try:
@@ -53,65 +515,416 @@ def transcribe_audio_file(audio_filepath):
 
         if not MODEL_LOADED or ASR_PIPELINE is None: # Check again
              return {"error": "STT model is not available even after attempting to load."}
+    return None
 
+def _decode_audio(source):
+    """Decodes a file path or file-like object to 16 kHz mono float32 samples.
 
-    if not os.path.exists(audio_filepath):
-        return {"error": f"Audio file not found: {audio_filepath}"}
+    Returns None when libsndfile cannot parse the container (e.g. browser WebM/Opus).
+    """
+    try:
+        samples, sample_rate = sf.read(source, dtype="float32")
+    except RuntimeError: # soundfile raises LibsndfileError (a RuntimeError) for unsupported formats
+        return None
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1) # Downmix to mono
+    if sample_rate != TARGET_SAMPLE_RATE:
+        samples = _resample(samples, sample_rate)
+    return samples
+
+def _resample(samples, sample_rate):
+    # Resampled on the CPU: the pipeline takes host arrays anyway, and a GPU round trip would
+    # only queue a copy back to the host behind whatever inference is running
+    waveform = torch.from_numpy(samples)
+    return torchaudio.functional.resample(waveform, sample_rate, TARGET_SAMPLE_RATE).numpy()
+
+def _decode_audio_bytes(audio_bytes):
+    return _decode_audio(io.BytesIO(audio_bytes))
+
+def _load_samples(audio_input):
+    """Returns 16 kHz mono float32 samples for a path, raw bytes/stream, or already decoded samples."""
+    if hasattr(audio_input, "dtype"):
+        return audio_input
+    if isinstance(audio_input, str):
+        samples = _decode_audio(audio_input)
+        if samples is not None:
+            return samples
+        with open(audio_input, "rb") as f:
+            audio_bytes = f.read()
+    elif isinstance(audio_input, io.BytesIO):
+        audio_bytes = audio_input.getvalue()
+    else:
+        audio_bytes = audio_input
+    samples = _decode_audio_bytes(audio_bytes)
+    if samples is None:
+        samples = ffmpeg_read(audio_bytes, TARGET_SAMPLE_RATE) # Containers libsndfile can't parse
+    return samples
+
+def _transcription_cache_key(audio_bytes):
+    return (LOADED_MODEL_NAME, hashlib.blake2b(audio_bytes, digest_size=16).hexdigest())
+
+def _get_cached_transcription(cache_key):
+    with _transcription_cache_lock:
+        result = _transcription_cache.get(cache_key)
+        if result is None:
+            return None
+        _transcription_cache.move_to_end(cache_key)
+    print("Transcription served from cache.")
+    return dict(result) # Callers get their own copy
+
+def _store_transcription(cache_key, result):
+    if "error" in result:
+        return # Failures are retried, not remembered
+    with _transcription_cache_lock:
+        _transcription_cache[cache_key] = dict(result)
+        _transcription_cache.move_to_end(cache_key)
+        if len(_transcription_cache) > TRANSCRIPTION_CACHE_SIZE:
+            _transcription_cache.popitem(last=False)
+
+def transcribe_audio_file(audio_filepath, gpu_id=None):
+    return transcribe_audio_files([audio_filepath], gpu_id=gpu_id)[0]
+
+def transcribe_audio_file_stream(audio_filepath, gpu_id=None):
+    """Yields the transcript of a file in pieces as it is decoded, instead of all at once.
+
+    faster-whisper yields each segment as it is finished; the transformers/ONNX pipeline
+    backends yield text fragments token by token for each 30s window. The TensorRT-LLM
+    backend yields the whole text once. On failure a single {"error": ...} dict is yielded.
+    """
+    model_error = _ensure_model_loaded()
+    if model_error:
+        yield model_error
+        return
+
+    try:
+        samples = _load_samples(audio_filepath)
+    except Exception as e:
+        print(f"Error decoding audio for streamed transcription: {e}")
+        yield {"error": str(e)}
+        return
+
+    print(f"Streaming transcription of: {audio_filepath} using model '{LOADED_MODEL_NAME}' ({STT_BACKEND})...")
+    if STT_BACKEND == "faster-whisper":
+        try:
+            segments, _ = ASR_PIPELINE.transcribe(samples, beam_size=BEAM_SIZE, vad_filter=True, language=STT_LANGUAGE)
+            for segment in segments: # Decoded lazily, one segment per iteration
+                yield segment.text
+        except Exception as e:
+            print(f"Error during streamed transcription: {e}")
+            yield {"error": str(e)}
+        return
+
+    if not _uses_hf_pipeline():
+        result = _transcribe(samples, audio_filepath, gpu_id)
+        yield result if "error" in result else result["text"]
+        return
+
+    window = STREAM_WINDOW_SECONDS * TARGET_SAMPLE_RATE
+    with _acquire_pipeline(gpu_id) as asr_pipeline:
+        for start in range(0, max(len(samples), 1), window):
+            try:
+                yield from _stream_window(asr_pipeline, samples[start:start + window])
+            except Exception as e:
+                print(f"Error during streamed transcription: {e}")
+                yield {"error": str(e)}
+                return
+
+def _stream_window(asr_pipeline, samples):
+    """Runs generate() for one window in a background thread and yields text as tokens arrive."""
+    model = asr_pipeline.model
+    features = asr_pipeline.feature_extractor(samples, sampling_rate=TARGET_SAMPLE_RATE, return_tensors="pt").input_features
+    features = features.to(model.device, dtype=getattr(model, "dtype", torch.float32))
+    streamer = TextIteratorStreamer(asr_pipeline.tokenizer, skip_prompt=True, skip_special_tokens=True)
+    stop_generation = threading.Event()
+    generate_errors = []
+
+    def generate():
+        try:
+            # Held per window rather than per stream, so a slow reader doesn't hold up the batcher
+            with _generate_lock(asr_pipeline), torch.inference_mode(): # inference_mode is thread-local
+                model.generate(input_features=features, streamer=streamer,
+                               stopping_criteria=StoppingCriteriaList([_StopOnEvent(stop_generation)]))
+        except Exception as e:
+            generate_errors.append(e)
+            streamer.end() # Unblocks the consumer below
 
+    generate_thread = threading.Thread(target=generate, name="stt-stream", daemon=True)
+    generate_thread.start()
     try:
-        current_model_name = ASR_PIPELINE.model.name_or_path if ASR_PIPELINE and hasattr(ASR_PIPELINE, 'model') else "Unknown"
-        print(f"Transcribing audio file: {audio_filepath} using model '{current_model_name}'...")
-
-        # For multilingual models, the pipeline usually detects language automatically.
-        # The exact way to get language depends on pipeline version and task configuration.
-        # We can pass `return_timestamps=True` or other flags to potentially get more metadata.
-        # Or, sometimes language is part of the main output.
-        # The `tokenizer` of the pipeline might also have language info after processing.
-
-        # Call pipeline to get transcription
-        # Some pipelines might allow generate_kwargs={"language": "en"} to force lang,
-        # but we want auto-detection.
-        prediction = ASR_PIPELINE(audio_filepath)
-        text = prediction["text"]
-
-        detected_language = None
-        # Try to extract language from prediction if available. This can be highly variable.
-        # Some pipelines might return a dict like {'text': '...', 'chunks': [{'language': 'en', ...}]}
-        # or {'text': '...', 'language': 'en'} directly.
-        if isinstance(prediction, dict):
-            if "language" in prediction: # Direct language key
-                detected_language = prediction["language"]
-            elif "chunks" in prediction and isinstance(prediction["chunks"], list) and len(prediction["chunks"]) > 0:
-                # Check if language is in the first chunk (common for some Whisper pipeline setups)
-                if isinstance(prediction["chunks"][0], dict) and "language" in prediction["chunks"][0]:
-                    detected_language = prediction["chunks"][0]["language"]
-
-        # Fallback: Check tokenizer if it has language information (less reliable for per-transcription)
-        if not detected_language:
-            if hasattr(ASR_PIPELINE, 'tokenizer') and hasattr(ASR_PIPELINE.tokenizer, 'language') and ASR_PIPELINE.tokenizer.language:
-                # This might be the model's default language or last used, not always current detection
-                print(f"Found language in tokenizer: {ASR_PIPELINE.tokenizer.language}. This might not be the detected language for this specific file.")
-                # detected_language = ASR_PIPELINE.tokenizer.language # Uncomment if this behavior is desired as a fallback
-
-        print(f"Transcription result: {text}")
-        if detected_language:
-            print(f"Detected language: {detected_language}")
-            return {"text": text, "language": detected_language}
+        for text in streamer:
+            if text:
+                yield text
+    finally:
+        stop_generation.set() # Ends generate() early if the caller stopped reading; no-op once it has finished
+        generate_thread.join()
+    if generate_errors:
+        raise generate_errors[0]
+
+def _input_duration(audio_input):
+    # Paths left undecoded (containers libsndfile can't parse) have an unknown length
+    return len(audio_input) / TARGET_SAMPLE_RATE if hasattr(audio_input, "dtype") else 0.0
+
+def transcribe_audio_files(audio_filepaths, batch_size=8, gpu_id=None):
+    """Transcribes several files, returning one result dict per path in the original order.
+
+    With the transformers backend, files are sorted by duration and batched in groups of
+    similar length, so little of each batched forward pass is spent on padding. gpu_id pins
+    the work to one GPU; by default the least loaded of STT_GPU_IDS is used.
+    """
+    model_error = _ensure_model_loaded()
+    if model_error:
+        return [model_error for _ in audio_filepaths]
+
+    results = [None] * len(audio_filepaths)
+    audio_inputs = {} # Index -> decoded samples, or the path when libsndfile can't read the file
+    cache_keys = {} # Index -> transcription cache key, for files small enough to cache
+    for index, audio_filepath in enumerate(audio_filepaths):
+        try:
+            file_size = os.path.getsize(audio_filepath)
+        except OSError: # Missing or unreadable
+            results[index] = {"error": f"Audio file not found: {audio_filepath}"}
+            continue
+        if file_size <= TRANSCRIPTION_CACHE_MAX_BYTES:
+            with open(audio_filepath, "rb") as f:
+                audio_bytes = f.read()
+            cache_key = _transcription_cache_key(audio_bytes)
+            cached_result = _get_cached_transcription(cache_key)
+            if cached_result is not None:
+                results[index] = cached_result
+                continue
+            cache_keys[index] = cache_key
+            samples = _decode_audio_bytes(audio_bytes)
+        elif _uses_hf_pipeline() and _file_duration(audio_filepath) > LONG_AUDIO_SECONDS:
+            results[index] = _transcribe_long_file(audio_filepath, gpu_id)
+            continue
         else:
-            print("Language detection data not found in standard output fields for this transcription.")
-            return {"text": text}
+            samples = _decode_audio(audio_filepath)
+        # Decoded once here so the pipeline doesn't spawn ffmpeg to re-read the file
+        audio_inputs[index] = audio_filepath if samples is None else samples
+    pending = list(audio_inputs) # Indices still to transcribe
+
+    if not _uses_hf_pipeline() or len(pending) == 1:
+        for index in pending:
+            results[index] = _transcribe(audio_inputs[index], audio_filepaths[index], gpu_id)
+    else:
+        _transcribe_in_buckets(pending, audio_inputs, results, batch_size, gpu_id)
+
+    for index, cache_key in cache_keys.items():
+        _store_transcription(cache_key, results[index])
+    return results
+
+def _file_duration(audio_filepath):
+    try:
+        info = sf.info(audio_filepath)
+        return info.frames / info.samplerate
+    except RuntimeError: # Container libsndfile can't parse; its length is unknown
+        return 0.0
+
+def _iter_file_windows(audio_filepath):
+    """Yields consecutive 30s windows of a file as pipeline inputs, reading one window at a time."""
+    with sf.SoundFile(audio_filepath) as audio_file:
+        frames_per_window = STREAM_WINDOW_SECONDS * audio_file.samplerate
+        while True:
+            block = audio_file.read(frames_per_window, dtype="float32")
+            if not len(block):
+                return
+            if block.ndim > 1:
+                block = block.mean(axis=1) # Downmix to mono
+            if audio_file.samplerate != TARGET_SAMPLE_RATE:
+                block = _resample(block, audio_file.samplerate)
+            yield {"raw": block, "sampling_rate": TARGET_SAMPLE_RATE}
+
+def _transcribe_long_file(audio_filepath, gpu_id=None):
+    """Transcribes a long recording with memory bounded by a few windows instead of the whole file.
+
+    Windows are cut without overlap, so a word straddling a boundary may be split.
+    """
+    print(f"Streaming long audio file: {audio_filepath} using model '{LOADED_MODEL_NAME}'...")
+    texts = []
+    detected_language = None
+    try:
+        with _acquire_pipeline(gpu_id) as asr_pipeline, _generate_lock(asr_pipeline), torch.inference_mode():
+            for prediction in asr_pipeline(_iter_file_windows(audio_filepath), batch_size=4,
+                                           return_timestamps=True, return_language=True):
+                texts.append(prediction["text"].strip())
+                detected_language = detected_language or (prediction.get("chunks") or [{}])[0].get("language")
+    except Exception as e:
+        print(f"Error during streamed transcription: {e}")
+        return {"error": str(e)}
+    text = " ".join(t for t in texts if t)
+    print(f"Transcription result: {text}")
+    if detected_language:
+        return {"text": text, "language": detected_language}
+    return {"text": text}
+
+def _transcribe_in_buckets(pending, audio_inputs, results, batch_size, gpu_id=None):
+    """Runs the transformers pipeline over pending inputs in batches of similar duration, filling results."""
+    pending.sort(key=lambda index: _input_duration(audio_inputs[index]))
+    for start in range(0, len(pending), batch_size):
+        bucket = pending[start:start + batch_size]
+        print(f"Transcribing a batch of {len(bucket)} files using model '{LOADED_MODEL_NAME}'...")
+        try:
+            with _acquire_pipeline(gpu_id) as asr_pipeline, _generate_lock(asr_pipeline), torch.inference_mode():
+                predictions = asr_pipeline(
+                    [_pipeline_input(audio_inputs[index]) for index in bucket],
+                    batch_size=batch_size,
+                    return_timestamps=True,
+                    return_language=True
+                )
+        except Exception as e:
+            print(f"Error during batched transcription: {e}")
+            for index in bucket:
+                results[index] = {"error": str(e)}
+            continue
+        for index, prediction in zip(bucket, predictions):
+            results[index] = _format_prediction(prediction)
+
+def transcribe_audio_bytes(audio_bytes):
+    """Transcribes an uploaded recording without writing it to disk."""
+    model_error = _ensure_model_loaded()
+    if model_error:
+        return model_error
+
+    cache_key = None
+    if len(audio_bytes) <= TRANSCRIPTION_CACHE_MAX_BYTES:
+        cache_key = _transcription_cache_key(audio_bytes)
+        cached_result = _get_cached_transcription(cache_key)
+        if cached_result is not None:
+            return cached_result
+
+    samples = _decode_audio_bytes(audio_bytes)
+    if samples is not None:
+        audio_input = samples
+    elif STT_BACKEND == "faster-whisper":
+        audio_input = io.BytesIO(audio_bytes) # Decoded in memory by faster-whisper via PyAV
+    else:
+        audio_input = audio_bytes # The HF pipeline pipes raw bytes through ffmpeg in memory
+
+    source_description = f"<{len(audio_bytes)} bytes in memory>"
+    if _uses_hf_pipeline():
+        result = _submit_to_batcher(audio_input, source_description).result()
+    else:
+        result = _transcribe(audio_input, source_description)
+    if cache_key is not None:
+        _store_transcription(cache_key, result)
+    return result
+
+def _pipeline_input(audio_input):
+    # Multilingual models detect the language themselves; with return_timestamps and
+    # return_language the pipeline reports it on each chunk of the prediction.
+    if hasattr(audio_input, "dtype"): # Already decoded samples
+        return {"raw": audio_input, "sampling_rate": TARGET_SAMPLE_RATE}
+    return audio_input
+
+def _format_prediction(prediction):
+    """Turns a transformers pipeline prediction into the {"text", "language"} result dict."""
+    text = prediction["text"]
+    detected_language = (prediction.get("chunks") or [{}])[0].get("language") # Empty when no speech was found
+
+    print(f"Transcription result: {text}")
+    if detected_language:
+        print(f"Detected language: {detected_language}")
+        return {"text": text, "language": detected_language}
+    else:
+        print("No language was reported for this transcription.")
+        return {"text": text}
+
+def _transcribe(audio_input, source_description, gpu_id=None):
+    """Runs the loaded backend on a file path, raw bytes/stream, or 16 kHz float32 samples."""
+    try:
+        current_model_name = LOADED_MODEL_NAME or "Unknown"
+        print(f"Transcribing audio: {source_description} using model '{current_model_name}' ({STT_BACKEND})...")
+
+        if STT_BACKEND == "faster-whisper":
+            # The VAD filter skips silent stretches of the recording.
+            # Language is detected by the model (unless STT_LANGUAGE is set) and reported in `info`.
+            segments, info = ASR_PIPELINE.transcribe(audio_input, beam_size=BEAM_SIZE, vad_filter=True, language=STT_LANGUAGE)
+            text = "".join(segment.text for segment in segments).strip()
+            print(f"Transcription result: {text}")
+            print(f"Detected language: {info.language}")
+            return {"text": text, "language": info.language}
+
+        if STT_BACKEND == "trtllm":
+            result = ASR_PIPELINE(_load_samples(audio_input))
+            print(f"Transcription result: {result['text']}")
+            return result
+
+        # inference_mode: no autograd bookkeeping (version counters, views) for any tensor
+        with _acquire_pipeline(gpu_id) as asr_pipeline, _generate_lock(asr_pipeline), torch.inference_mode():
+            prediction = asr_pipeline(_pipeline_input(audio_input), batch_size=PIPELINE_BATCH_SIZE,
+                                      return_timestamps=True, return_language=True)
+        return _format_prediction(prediction)
 
     except Exception as e:
         print(f"Error during transcription: {e}")
         return {"error": str(e)}
 
+def _submit_to_batcher(audio_input, source_description):
+    """Queues audio for the batching threads and returns a Future resolving to the result dict."""
+    global _batcher_threads
+    if not any(thread.is_alive() for thread in _batcher_threads):
+        with _batcher_lock:
+            # Started lazily so each (possibly forked) worker process gets its own threads;
+            # one per GPU so batches on different GPUs run concurrently
+            if not any(thread.is_alive() for thread in _batcher_threads):
+                _batcher_threads = [
+                    threading.Thread(target=_batcher_loop, name=f"stt-batcher-{i}", daemon=True)
+                    for i in range(max(1, len(STT_GPU_IDS)))
+                ]
+                for thread in _batcher_threads:
+                    thread.start()
+    future = Future()
+    _batch_queue.put((audio_input, source_description, future))
+    return future
+
+def _batcher_loop():
+    if DEVICE.startswith("cuda"):
+        torch.cuda.set_device(DEVICE) # A new thread starts on cuda:0, not on the device set while loading
+    while True:
+        batch = [_batch_queue.get()]
+        deadline = time.monotonic() + BATCH_WINDOW_S
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_batch_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _run_batch(batch)
+
+def _run_batch(batch):
+    if len(batch) == 1:
+        audio_input, source_description, future = batch[0]
+        future.set_result(_transcribe(audio_input, source_description))
+        return
+
+    print(f"Transcribing a batch of {len(batch)} queued requests using model '{LOADED_MODEL_NAME}'...")
+    try:
+        with _acquire_pipeline() as asr_pipeline, _generate_lock(asr_pipeline), torch.inference_mode():
+            predictions = asr_pipeline(
+                [_pipeline_input(audio_input) for audio_input, _, _ in batch],
+                batch_size=PIPELINE_BATCH_SIZE,
+                return_timestamps=True,
+                return_language=True
+            )
+    except Exception as e:
+        # One bad upload (e.g. a truncated WebM) fails the whole batch; retry each request
+        # on its own so only that one gets the error
+        print(f"Error during batched transcription, retrying requests one by one: {e}")
+        for audio_input, source_description, future in batch:
+            future.set_result(_transcribe(audio_input, source_description))
+        return
+    for (_, _, future), prediction in zip(batch, predictions):
+        future.set_result(_format_prediction(prediction))
+
 if __name__ == "__main__":
     print("Running speech_to_text_whispr.py in standalone mode (multilingual).")
     print(f"Attempting to use device: {DEVICE}")
     try:
-        load_stt_model() # Load default multilingual model (openai/whisper-base)
+        load_stt_model() # Load default multilingual model (DEFAULT_MODEL_NAME)
         if MODEL_LOADED and ASR_PIPELINE:
-            print(f"Model '{ASR_PIPELINE.model.name_or_path}' loaded. To test, call transcribe_audio_file('path/to/audio.wav')")
+            print(f"Model '{LOADED_MODEL_NAME}' loaded with {STT_BACKEND}. To test, call transcribe_audio_file('path/to/audio.wav')")
             print("Consider using a non-English audio file for a more thorough multilingual test.")
             # Example (requires a dummy audio file to be present for actual testing):
             # if os.path.exists("dummy_audio_multilingual.wav"):